@@ -0,0 +1,332 @@
+"""
+Benchmark suite of the REST API, for comparing commits.
+
+Seeds a dataset of ``--users`` users with ``--records`` records each on average
+(a share of them editors and admins, see ``manage.py seed``) into each database, then runs every scenario at every
+``--concurrency`` level for ``--duration`` seconds, through each target:
+
+* ``client``: the Flask test client, one thread per concurrent client, in this process
+* ``http``: the threaded Werkzeug server in a subprocess, one keep-alive connection
+  per concurrent client
+
+Scenarios:
+
+* ``users_records``: users listing a page of their records
+* ``add_record``: users adding a record
+* ``users``: admins listing a page of users
+* ``login``: users logging in with their password (``--hash-rounds`` bcrypt rounds)
+* ``statistics``: users querying the statistics of their whole history
+
+Databases:
+
+* ``sqlite``: a temporary SQLite database file
+* ``mysql``: the database given with ``--mysql-uri``, e.g. a local MySQL server
+  standing in for the production one (its tables are dropped afterwards)
+
+The throughput and latency percentiles are printed and, with ``--output``, saved as
+JSON along with the commit and the parameters. ``--compare`` prints the changes
+against the results of an earlier run.
+
+Usage::
+
+    python benchmarks/api_suite.py --output results.json
+    git checkout other-branch && python benchmarks/api_suite.py --compare results.json
+    python benchmarks/api_suite.py --databases sqlite mysql --mysql-uri mysql+pymysql://user@localhost/eatme_bench
+    python benchmarks/api_suite.py --targets client --scenarios users_records --concurrency 1 8 --users 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+
+from load_test import HTTPConnection, free_port, percentile, wait_for_port
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ('users_records', 'add_record', 'users', 'login', 'statistics')
+TARGETS = ('client', 'http')
+DATABASES = ('sqlite', 'mysql')
+
+SERVER = ("from werkzeug.serving import run_simple; from eatme import create_app; app = create_app(); "
+          "run_simple('127.0.0.1', {port}, app, threaded=True)")
+
+MEALTIMES = ((8, 0), (12, 30), (16, 0), (19, 30))
+
+
+def seed(n_users, n_records, password, editor_share, admin_share, years):
+    """
+    Add the benchmark users with their roles and records, in an app context.
+    Returns the users as ``(id, email, token, is_admin)`` tuples.
+    """
+    from eatme import create_db, db, models, password_hasher
+    from eatme.seed import seed as seed_database
+
+    create_db()
+    user_ids = seed_database(n_users, n_records, password_hasher.encrypt(password), years=years,
+                             editor_share=editor_share, admin_share=admin_share, email_prefix='bench',
+                             random_seed=42)
+    users = models.User.query.filter(models.User.id.in_(user_ids)).order_by(models.User.id).all()
+    result = [(user.id, user.email, user.get_auth_token(), user.has_role('admin')) for user in users]
+    if not any(is_admin for _, _, _, is_admin in result):
+        admin = models.User.query.filter_by(email=current_app.config['ADMIN_EMAIL']).one()
+        result.append((admin.id, admin.email, admin.get_auth_token(), True))
+    db.session.remove()
+    return result
+
+
+def make_request(scenario, dataset, client, i, page_size):
+    """
+    The ``i``-th request of a concurrent client as ``(method, path, token, payload)``
+    """
+    users, admins, password = dataset['users'], dataset['admins'], dataset['password']
+    if scenario == 'users_records':
+        user_id, _, token, _ = users[(client + i * 7919) % len(users)]
+        return 'GET', '/api/v1/users/{}/records?limit={}'.format(user_id, page_size), token, None
+    if scenario == 'add_record':
+        user_id, _, token, _ = users[client % len(users)]
+        record = {'userid': user_id,
+                  'record_date': (date.today() - timedelta(days=i % 365)).isoformat(),
+                  'record_time': '{:02d}:{:02d}'.format(*MEALTIMES[i % len(MEALTIMES)]),
+                  'description': 'Benchmark meal',
+                  'calories': 100 + i % 800}
+        return 'POST', '/api/v1/records', token, record
+    if scenario == 'users':
+        _, _, token, _ = admins[client % len(admins)]
+        return 'GET', '/api/v1/users?limit={}'.format(page_size), token, None
+    if scenario == 'statistics':
+        user_id, _, token, _ = users[(client + i * 7919) % len(users)]
+        return 'GET', '/api/v1/users/{}/statistics'.format(user_id), token, None
+    _, email, _, _ = users[(client + i * 7919) % len(users)]
+    return 'POST', '/login', None, {'email': email, 'password': password}
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {'requests': len(latencies),
+            'errors': len(errors),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': 1000 * percentile(latencies, 0.50),
+            'p90_ms': 1000 * percentile(latencies, 0.90),
+            'p99_ms': 1000 * percentile(latencies, 0.99),
+            'max_ms': 1000 * latencies[-1] if latencies else float('nan')}
+
+
+def run_client(app, scenario, dataset, concurrency, duration, page_size):
+    """
+    Run a scenario through the Flask test client, one thread per concurrent client.
+    """
+    latencies, errors = [], []
+
+    def client_thread(client, deadline):
+        test_client = app.test_client(use_cookies=False)
+        i = 0
+        while time.perf_counter() < deadline:
+            method, path, token, payload = make_request(scenario, dataset, client, i, page_size)
+            headers = {'Authorization': token} if token is not None else {}
+            start = time.perf_counter()
+            response = test_client.open(path, method=method, headers=headers, content_type='application/json',
+                                        data=json.dumps(payload) if payload is not None else None)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status_code)
+            i += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_thread, args=(client, started + duration))
+               for client in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def http_client(port, scenario, dataset, client, deadline, page_size, latencies, errors):
+    connection = HTTPConnection('127.0.0.1', port)
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            method, path, token, payload = make_request(scenario, dataset, client, i, page_size)
+            headers = {'Content-Type': 'application/json'}
+            if token is not None:
+                headers['Authorization'] = token
+            body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+            i += 1
+            start = time.perf_counter()
+            try:
+                status, _ = await connection.request(method, path, headers, body)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                connection.close()
+                errors.append('connection')
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+    finally:
+        connection.close()
+
+
+def run_http(loop, port, scenario, dataset, concurrency, duration, page_size):
+    """
+    Run a scenario against the HTTP server, one keep-alive connection per concurrent client.
+    """
+    latencies, errors = [], []
+    started = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(*[
+        http_client(port, scenario, dataset, client, started + duration, page_size, latencies, errors)
+        for client in range(concurrency)]))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def start_server(config_file):
+    port = free_port()
+    env = dict(os.environ, APP_CONFIG_FILE=config_file, PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, '-c', SERVER.format(port=port)],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process, port
+
+
+def run_database(database, uri, args, loop):
+    """
+    Seed a database and run all the scenarios against it. Returns the result rows.
+    """
+    from eatme import create_app, db
+
+    config = {'DATABASE_URI': uri,
+              'PASSWORD_HASH_ROUNDS': args.hash_rounds,
+              # Hash on the request thread, leaving no hashing processes behind on terminate
+              'PASSWORD_HASH_WORKERS': 0}
+    app = create_app(config)
+    with app.app_context():
+        users = seed(args.users, args.records, args.password, args.editor_share, args.admin_share, args.years)
+    dataset = {'users': users, 'admins': [user for user in users if user[3]], 'password': args.password}
+
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as config_file:
+        config_file.write(''.join('{} = {!r}\n'.format(name, value) for name, value in config.items()))
+    rows = []
+    try:
+        for target in args.targets:
+            server, port = start_server(config_file.name) if target == 'http' else (None, None)
+            try:
+                for scenario in args.scenarios:
+                    for concurrency in args.concurrency:
+                        if target == 'http':
+                            result = run_http(loop, port, scenario, dataset, concurrency, args.duration,
+                                              args.page_size)
+                        else:
+                            result = run_client(app, scenario, dataset, concurrency, args.duration,
+                                                args.page_size)
+                        result.update(database=database, target=target, scenario=scenario,
+                                      concurrency=concurrency)
+                        rows.append(result)
+                        print_row(result)
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+    finally:
+        os.unlink(config_file.name)
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+            db.get_engine(app).dispose()
+    return rows
+
+
+def row_key(row):
+    return row['database'], row['target'], row['scenario'], row['concurrency']
+
+
+def print_row(row, baseline=None):
+    line = "{database:6} {target:6} {scenario:13} x{concurrency:<4} {requests:7} requests {errors:5} errors " \
+           "{requests_per_second:8.1f} req/s  p50 {p50_ms:7.1f} ms  p90 {p90_ms:7.1f} ms  p99 {p99_ms:7.1f} ms"
+    line = line.format(**row)
+    if baseline is not None:
+        line += "  ({:+.0%} req/s, {:+.0%} p99)".format(
+            row['requests_per_second'] / baseline['requests_per_second'] - 1,
+            row['p99_ms'] / baseline['p99_ms'] - 1)
+    print(line)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--databases', nargs='+', choices=DATABASES, default=['sqlite'])
+    parser.add_argument('--mysql-uri', help="Database for the mysql runs")
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 10, 50])
+    parser.add_argument('--duration', type=float, default=5, help="Seconds per scenario and concurrency level")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--records', type=int, default=500, help="Records per user, on average")
+    parser.add_argument('--years', type=float, default=2, help="Longest history of the users")
+    parser.add_argument('--editor-share', type=float, default=0.1)
+    parser.add_argument('--admin-share', type=float, default=0.02)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--password', default='benchmark-password')
+    parser.add_argument('--hash-rounds', type=int, default=4, help="bcrypt rounds of the users' passwords")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+    if 'mysql' in args.databases and not args.mysql_uri:
+        parser.error("the mysql database needs --mysql-uri")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = {row_key(row): row for row in json.load(previous)['results']}
+
+    loop = asyncio.get_event_loop()
+    rows = []
+    for database in args.databases:
+        sqlite_file = None
+        if database == 'mysql':
+            uri = args.mysql_uri
+        else:
+            fd, sqlite_file = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            uri = 'sqlite:///' + sqlite_file
+        try:
+            rows.extend(run_database(database, uri, args, loop))
+        finally:
+            if sqlite_file is not None:
+                os.unlink(sqlite_file)
+
+    if baseline:
+        print("\nCompared with {}:".format(args.compare))
+        for row in rows:
+            if row_key(row) in baseline:
+                print_row(row, baseline[row_key(row)])
+    if args.output:
+        parameters = {name: value for name, value in vars(args).items()
+                      if name not in ('output', 'compare', 'mysql_uri', 'password')}
+        with open(args.output, 'w') as output:
+            json.dump({'commit': git_commit(), 'date': datetime.utcnow().isoformat() + 'Z',
+                       'parameters': parameters, 'results': rows}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark of concurrent record writes under the database connection settings.
+
+Each variant runs in its own process on a fresh database: ``--threads`` threads,
+each logged in as its own user, add records through ``POST /api/v1/records`` with
+the Flask test client for ``--duration`` seconds. Reports the throughput, latency
+percentiles and failed requests (e.g. "database is locked") of each variant.
+
+Variants:
+
+* ``sqlite-default``: the previous settings, rollback journal and ``synchronous=FULL``
+* ``sqlite-wal``: the default settings, WAL journal, ``synchronous=NORMAL``, busy timeout
+* ``mysql``: the database given with ``--mysql-uri`` (its tables are dropped afterwards)
+
+Usage::
+
+    python benchmarks/db_concurrency.py --threads 16 --duration 10
+    python benchmarks/db_concurrency.py --variants mysql --mysql-uri mysql+pymysql://user@localhost/eatme_bench
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+VARIANTS = {
+    'sqlite-default': "SQLITE_JOURNAL_MODE = 'DELETE'\nSQLITE_SYNCHRONOUS = 'FULL'\nSQLITE_BUSY_TIMEOUT = None\n",
+    'sqlite-wal': "",
+    'mysql': "",
+}
+
+COMMON_CONFIG = "PASSWORD_HASH_ROUNDS = 4\nPASSWORD_HASH_WORKERS = 0\nRESULT_CACHE_BACKEND = None\n"
+
+
+def writer(app, token, user_id, deadline, latencies, errors):
+    client = app.test_client()
+    headers = {'Authorization': token}
+    i = 0
+    while time.perf_counter() < deadline:
+        record = {'userid': user_id,
+                  'record_date': '2016-{:02d}-{:02d}'.format(1 + i // 28 % 12, 1 + i % 28),
+                  'record_time': '{:02d}:30'.format(7 + 5 * (i % 3)),
+                  'description': 'Meal',
+                  'calories': 200 + i % 600}
+        start = time.perf_counter()
+        response = client.post('/api/v1/records', data=json.dumps(record),
+                               content_type='application/json', headers=headers)
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(response.status_code)
+        i += 1
+
+
+def run_variant(threads, duration):
+    """
+    Run the benchmark in this process, configured through ``APP_CONFIG_FILE``.
+    """
+    sys.path.insert(0, ROOT)
+    from eatme import create_app, create_db, db, password_hasher, user_datastore
+
+    app = create_app()
+    with app.app_context():
+        create_db()
+        password = password_hasher.encrypt('benchmark')
+        users = [user_datastore.create_user(email='writer{}@example.com'.format(i), password=password)
+                 for i in range(threads)]
+        db.session.commit()
+        writers = [(user.get_auth_token(), user.id) for user in users]
+        db.session.remove()
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    workers = [threading.Thread(target=writer, args=(app, token, user_id, deadline, latencies, errors))
+               for token, user_id in writers]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        db.drop_all()
+    latencies.sort()
+    return {'requests': len(latencies),
+            'errors': len(errors),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': 1000 * latencies[len(latencies) // 2] if latencies else None,
+            'p99_ms': 1000 * latencies[int(0.99 * len(latencies))] if latencies else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--variants', nargs='+', choices=sorted(VARIANTS), default=['sqlite-default', 'sqlite-wal'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--mysql-uri', help="Database for the mysql variant")
+    parser.add_argument('--run-variant', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_variant:
+        print(json.dumps(run_variant(args.threads, args.duration)))
+        return
+
+    for variant in args.variants:
+        database = None
+        if variant == 'mysql':
+            if not args.mysql_uri:
+                parser.error("the mysql variant needs --mysql-uri")
+            uri = args.mysql_uri
+        else:
+            fd, database = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            uri = 'sqlite:///' + database
+        with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as config:
+            config.write("DATABASE_URI = {!r}\n".format(uri) + COMMON_CONFIG + VARIANTS[variant])
+        try:
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--run-variant',
+                 '--threads', str(args.threads), '--duration', str(args.duration)],
+                env=dict(os.environ, APP_CONFIG_FILE=config.name))
+        finally:
+            os.unlink(config.name)
+            if database is not None:
+                os.unlink(database)
+        result = json.loads(output.decode('utf-8').splitlines()[-1])
+        print("{}: {requests} writes, {errors} failed, {requests_per_second:.1f} writes/s, "
+              "p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms".format(variant, **result))
+
+
+if __name__ == '__main__':
+    main()
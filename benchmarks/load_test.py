@@ -0,0 +1,256 @@
+"""
+Load test of the API under the WSGI and ASGI serving modes.
+
+Starts the app in each serving mode on a temporary SQLite database, seeds a user
+with records through the API, then keeps ``--concurrency`` keep-alive connections
+busy requesting the user's records for ``--duration`` seconds and reports the
+throughput and latency percentiles of each mode.
+
+* ``wsgi``: the threaded Werkzeug server, as ``runserver.py`` and ``manage.py runserver``
+* ``asgi``: uvicorn serving ``eatme.asgi:application`` (needs ``uvicorn`` and ``a2wsgi`` installed)
+
+Usage::
+
+    python benchmarks/load_test.py --concurrency 200 --duration 30
+    python benchmarks/load_test.py --modes asgi --records 5000
+    python benchmarks/load_test.py --url http://localhost:8000 --email me@example.com --password secret
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SERVERS = {
+    'wsgi': "from werkzeug.serving import run_simple; from eatme import create_app; app = create_app(); "
+            "run_simple('127.0.0.1', {port}, app, threaded=True)",
+    'asgi': "import uvicorn; "
+            "uvicorn.run('eatme.asgi:application', host='127.0.0.1', port={port}, log_level='warning')",
+}
+
+
+class HTTPConnection(object):
+    """
+    Minimal asyncio HTTP/1.1 client connection, reconnecting when the server closes it
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = ['{} {} HTTP/1.1'.format(method, path),
+                 'Host: {}:{}'.format(self.host, self.port),
+                 'Content-Length: {}'.format(len(body))]
+        lines.extend('{}: {}'.format(name, value) for name, value in (headers or {}).items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding') == 'chunked':
+            data = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                data += chunk[:-2]
+            data = bytes(data)
+        elif 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length']))
+        else:
+            data = await self.reader.read()
+
+        connection = response_headers.get('connection', '').lower()
+        if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+            self.close()
+        return int(status), data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def api_call(connection, method, path, token=None, payload=None):
+    headers = {'Content-Type': 'application/json'}
+    if token is not None:
+        headers['Authorization'] = token
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    status, data = await connection.request(method, path, headers, body)
+    if status != 200:
+        raise RuntimeError("{} {} failed with {}: {}".format(method, path, status, data[:200]))
+    return json.loads(data.decode('utf-8'))
+
+
+async def prepare(host, port, email, password, n_records):
+    """
+    Register and log in the load test user, add ``n_records`` records if the user is
+    new. Returns the authentication token and the user's records URL.
+    """
+    connection = HTTPConnection(host, port)
+    try:
+        if n_records:
+            status, _ = await connection.request('POST', '/api/v1/users', {'Content-Type': 'application/json'},
+                                                 json.dumps({'email': email, 'password': password}).encode('utf-8'))
+        login = await api_call(connection, 'POST', '/login', payload={'email': email, 'password': password})
+        token = login['response']['user']['authentication_token']
+        user = (await api_call(connection, 'GET', '/api/v1/users/self', token))['response']['user']
+        if n_records and status == 200:
+            records = [{'userid': user['id'],
+                        'record_date': '2016-{:02d}-{:02d}'.format(1 + i // 28 % 12, 1 + i % 28),
+                        'record_time': '{:02d}:30'.format(7 + 5 * (i % 3)),
+                        'description': 'Meal',
+                        'calories': 200 + i % 600}
+                       for i in range(n_records)]
+            await api_call(connection, 'POST', '/api/v1/records/batch', token, records)
+        return token, urlsplit(user['_links']['records']).path
+    finally:
+        connection.close()
+
+
+async def worker(host, port, path, token, deadline, latencies, errors):
+    connection = HTTPConnection(host, port)
+    headers = {'Authorization': token}
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _ = await connection.request('GET', path, headers)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                connection.close()
+                errors.append('connection')
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+    finally:
+        connection.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def load(host, port, path, token, concurrency, duration):
+    latencies, errors = [], []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[worker(host, port, path, token, deadline, latencies, errors)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {'requests': len(latencies),
+            'errors': len(errors),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': 1000 * percentile(latencies, 0.50),
+            'p99_ms': 1000 * percentile(latencies, 0.99)}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start on port {}".format(port))
+
+
+def start_server(mode, config_file):
+    port = free_port()
+    env = dict(os.environ, APP_CONFIG_FILE=config_file, PYTHONPATH=ROOT)
+    subprocess.check_call([sys.executable, 'manage.py', 'create_db'], cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    process = subprocess.Popen([sys.executable, '-c', SERVERS[mode].format(port=port)],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process, port
+
+
+def run(loop, host, port, args, n_records):
+    token, path = loop.run_until_complete(prepare(host, port, args.email, args.password, n_records))
+    path += '?limit={}'.format(args.page_size)
+    loop.run_until_complete(load(host, port, path, token, min(args.concurrency, 10), 1))  # warm up
+    return loop.run_until_complete(load(host, port, path, token, args.concurrency, args.duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--modes', nargs='+', choices=sorted(SERVERS), default=sorted(SERVERS))
+    parser.add_argument('--url', help="Load test an already running server instead")
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--records', type=int, default=1000, help="Records of the load test user")
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--email', default='loadtest@example.com')
+    parser.add_argument('--password', default='loadtest-password')
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    results = {}
+    if args.url:
+        url = urlsplit(args.url)
+        results[args.url] = run(loop, url.hostname, url.port or 80, args, 0)
+    else:
+        for mode in args.modes:
+            fd, database = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as config:
+                config.write("DATABASE_URI = {!r}\n".format('sqlite:///' + database))
+                # Hash on the request thread, leaving no hashing processes behind on terminate
+                config.write("PASSWORD_HASH_WORKERS = 0\n")
+            process, port = start_server(mode, config.name)
+            try:
+                results[mode] = run(loop, '127.0.0.1', port, args, args.records)
+            finally:
+                process.terminate()
+                process.wait()
+                os.unlink(config.name)
+                os.unlink(database)
+
+    for name, result in results.items():
+        print("{}: {requests} requests, {errors} errors, {requests_per_second:.1f} req/s, "
+              "p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms".format(name, **result))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'concurrency': args.concurrency, 'duration': args.duration, 'results': results},
+                      output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
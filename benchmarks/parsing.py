@@ -0,0 +1,71 @@
+"""
+Benchmark of record date and time parsing for batch imports.
+
+Parses the dates and times of a synthetic batch the way the API used to, with
+``datetime.strptime`` picking the format by string length, and with ``eatme.parsing``.
+
+Usage::
+
+    python benchmarks/parsing.py --records 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eatme.parsing import parse_date, parse_time  # noqa: E402
+
+
+def strptime_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def strptime_time(value):
+    if len(value) > 5:
+        return datetime.strptime(value, '%H:%M:%S').time()
+    else:
+        return datetime.strptime(value, '%H:%M').time()
+
+
+def make_batch(n_records):
+    rng = random.Random(42)
+    batch = []
+    for _ in range(n_records):
+        record_time = '{:02d}:{:02d}'.format(rng.randint(0, 23), rng.randint(0, 59))
+        if rng.random() < 0.5:
+            record_time += ':{:02d}'.format(rng.randint(0, 59))
+        batch.append({'record_date': '{:04d}-{:02d}-{:02d}'.format(rng.randint(2010, 2016),
+                                                                   rng.randint(1, 12),
+                                                                   rng.randint(1, 28)),
+                      'record_time': record_time})
+    return batch
+
+
+def measure(batch, date_parser, time_parser):
+    start = time.perf_counter()
+    for item in batch:
+        date_parser(item['record_date'])
+        time_parser(item['record_time'])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    batch = make_batch(args.records)
+    before = measure(batch, strptime_date, strptime_time)
+    after = measure(batch, parse_date, parse_time)
+    print("Parsing {} records:".format(args.records))
+    print("  strptime      {:8.1f} ms  {:>10,.0f} records/s".format(1000 * before, args.records / before))
+    print("  eatme.parsing {:8.1f} ms  {:>10,.0f} records/s".format(1000 * after, args.records / after))
+    print("  speedup {:.1f}x".format(before / after))
+
+
+if __name__ == '__main__':
+    main()
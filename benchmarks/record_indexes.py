@@ -0,0 +1,144 @@
+"""
+Benchmark of the record query hot path with and without the record indexes.
+
+Seeds a database with synthetic records (no indexes), then prints the query plan
+and timing of the records listing and daily aggregation queries, creates the
+indexes defined on ``models.Record`` and repeats the measurements.
+
+Usage::
+
+    python benchmarks/record_indexes.py --records 1000000 --users 1000
+    python benchmarks/record_indexes.py --database mysql+pymysql://user@localhost/eatme_bench
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, time as dtime, timedelta
+
+from sqlalchemy import create_engine, desc, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eatme import models  # noqa: E402
+
+record_table = models.Record.__table__
+
+
+def seed(engine, n_records, n_users, chunk_size=10000):
+    """
+    Insert ``n_records`` records spread over ``n_users`` users.
+    """
+    first_day = date(2012, 1, 1)
+    rng = random.Random(42)
+    inserted = 0
+    while inserted < n_records:
+        rows = []
+        for _ in range(min(chunk_size, n_records - inserted)):
+            rows.append({'user_id': rng.randint(1, n_users),
+                         'record_date': first_day + timedelta(days=rng.randint(0, 4 * 365)),
+                         'record_time': dtime(rng.randint(6, 22), rng.randint(0, 59)),
+                         'description': 'Meal',
+                         'calories': rng.randint(50, 1200)})
+        engine.execute(record_table.insert(), rows)
+        inserted += len(rows)
+
+
+def queries(user_id):
+    """
+    The queries issued by ``users_records`` and ``users_daily``.
+    """
+    c = record_table.c
+    listing = select([record_table]) \
+        .where(c.user_id == user_id) \
+        .where(c.record_date >= date(2014, 1, 1)) \
+        .where(c.record_date <= date(2014, 12, 31)) \
+        .where(c.record_time >= dtime(12, 0)) \
+        .order_by(desc(c.record_date), desc(c.record_time), desc(c.id)) \
+        .limit(100)
+    daily = select([c.record_date, func.sum(c.calories), func.count(c.id)]) \
+        .where(c.user_id == user_id) \
+        .group_by(c.record_date) \
+        .order_by(desc(c.record_date))
+    return [('records listing', listing), ('daily totals', daily)]
+
+
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN of a select statement, keeping its bound parameters.
+    """
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    prefix = 'EXPLAIN QUERY PLAN ' if compiler.dialect.name == 'sqlite' else 'EXPLAIN '
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def explain(engine, statement):
+    return engine.execute(Explain(statement)).fetchall()
+
+
+def measure(engine, n_users, repeat):
+    for name, statement in queries(1):
+        print("  {}:".format(name))
+        for row in explain(engine, statement):
+            print("    plan: {}".format(tuple(row)))
+        timings = []
+        for i in range(repeat):
+            _, statement = [q for q in queries(1 + i % n_users) if q[0] == name][0]
+            start = time.perf_counter()
+            engine.execute(statement).fetchall()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print("    median {:.3f} ms, max {:.3f} ms over {} runs".format(
+            1000 * timings[len(timings) // 2], 1000 * timings[-1], repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database', help="Database URI, defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    tmpfile = None
+    if args.database is None:
+        fd, tmpfile = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        args.database = 'sqlite:///' + tmpfile
+    engine = create_engine(args.database)
+    try:
+        models.db.metadata.create_all(engine, tables=[models.User.__table__, record_table])
+        for index in record_table.indexes:
+            index.drop(bind=engine)
+
+        start = time.perf_counter()
+        seed(engine, args.records, args.users)
+        print("Seeded {} records in {:.1f} s".format(args.records, time.perf_counter() - start))
+
+        print("Without indexes:")
+        measure(engine, args.users, args.repeat)
+
+        start = time.perf_counter()
+        for index in record_table.indexes:
+            index.create(bind=engine)
+        print("Created indexes in {:.1f} s".format(time.perf_counter() - start))
+
+        print("With indexes:")
+        measure(engine, args.users, args.repeat)
+    finally:
+        models.db.metadata.drop_all(engine, tables=[record_table, models.User.__table__])
+        if tmpfile is not None:
+            os.unlink(tmpfile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the records listing response serialization.
+
+Serializes a 10k record response the previous way (marshmallow ``records_schema`` and
+pretty printed ``flask.jsonify``) and with ``models.dump_records`` and the compact
+``eatme.serialization.jsonify``, for each available JSON backend.
+
+Usage::
+
+    python benchmarks/serialization.py --records 10000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, time as dtime, timedelta
+
+import flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eatme import create_app, models, serialization  # noqa: E402
+from eatme.api import wrap200code  # noqa: E402
+
+
+def make_records(n_records):
+    created = datetime(2016, 4, 19, 5, 43, 2)
+    return [models.Record(id=i,
+                          date_created=created,
+                          date_modified=created,
+                          record_date=date(2016, 4, 19) - timedelta(days=i // 3),
+                          record_time=dtime(8 + 5 * (i % 3), 30),
+                          description='Sandwich',
+                          calories=150,
+                          user_id=2)
+            for i in range(n_records)]
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(response.get_data())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    records = make_records(args.records)
+
+    def before():
+        return flask.jsonify(wrap200code(records=models.records_schema.dump(records).data))
+
+    def after():
+        return serialization.jsonify(wrap200code(records=models.dump_records(records)))
+
+    backends = ['stdlib'] + (['orjson'] if serialization.orjson is not None else [])
+    print("Serializing {} records:".format(args.records))
+    with app.test_request_context():
+        app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+        baseline, size = best_of(before, args.repeat)
+        print("  {:<32} {:8.1f} ms {:>10,.0f} records/s {:>10,} bytes".format(
+            'marshmallow + flask.jsonify', 1000 * baseline, args.records / baseline, size))
+        app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+        for backend in backends:
+            app.config['JSON_BACKEND'] = backend
+            seconds, size = best_of(after, args.repeat)
+            print("  {:<32} {:8.1f} ms {:>10,.0f} records/s {:>10,} bytes  ({:.1f}x)".format(
+                'dump_records + ' + backend, 1000 * seconds, args.records / seconds, size, baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
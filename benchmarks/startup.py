@@ -0,0 +1,59 @@
+"""
+Benchmark of worker startup: importing the app, creating it and the first requests.
+
+Each run is a fresh Python process, measuring the time to import ``eatme``, to
+create the app with ``create_app()`` (or to get ``eatme.app`` in trees before the
+application factory) and the time of the first and second request.
+
+Usage::
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --root /path/to/older/checkout
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MEASURE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import eatme
+imported = time.perf_counter()
+app = eatme.create_app() if hasattr(eatme, 'create_app') else eatme.app
+created = time.perf_counter()
+client = app.test_client()
+client.get({path!r})
+first = time.perf_counter()
+client.get({path!r})
+second = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'create_app': created - imported,
+                   'first_request': first - created, 'second_request': second - first}}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--root', default=ROOT, help="Checkout of the app to measure")
+    parser.add_argument('--path', default='/api/v1/users/self', help="Path of the requests")
+    args = parser.parse_args()
+
+    code = MEASURE.format(root=os.path.abspath(args.root), path=args.path)
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=args.root)
+        runs.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    for step in ('import', 'create_app', 'first_request', 'second_request'):
+        timings = sorted(run[step] for run in runs)
+        print("{:15} median {:7.1f} ms, max {:7.1f} ms".format(
+            step, 1000 * timings[len(timings) // 2], 1000 * timings[-1]))
+
+
+if __name__ == '__main__':
+    main()
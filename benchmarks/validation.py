@@ -0,0 +1,60 @@
+"""
+Microbenchmark of request payload validation.
+
+Compares validations per second of ``flask_inputs``' ``JsonSchema``, which checks the
+schema and builds a validator on every call, with the precompiled validators used
+by the API, both for single records and for batches of records.
+
+Usage::
+
+    python benchmarks/validation.py --number 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import jsonschema
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eatme.api import new_record_schema, new_record_validator  # noqa: E402
+
+RECORD = {'record_date': '2016-04-12',
+          'record_time': '12:30',
+          'calories': 120,
+          'description': 'Sandwich',
+          'userid': 2}
+
+
+def report(name, seconds, number):
+    print("  {:<12} {:>12,.0f} validations/s".format(name, number / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+
+    print("Single record:")
+    rebuilt = timeit.timeit(lambda: jsonschema.validate(RECORD, new_record_schema), number=args.number)
+    report('per request', rebuilt, args.number)
+    compiled = timeit.timeit(lambda: list(new_record_validator.iter_errors(RECORD)), number=args.number)
+    report('compiled', compiled, args.number)
+    print("  speedup {:.1f}x".format(rebuilt / compiled))
+
+    print("Batch of {} records:".format(args.batch))
+    batch = [dict(RECORD, calories=i) for i in range(args.batch)]
+    number = max(1, args.number // args.batch)
+    rebuilt = timeit.timeit(lambda: [jsonschema.validate(item, new_record_schema) for item in batch],
+                            number=number)
+    report('per request', rebuilt, number * args.batch)
+    compiled = timeit.timeit(lambda: [list(new_record_validator.iter_errors(item)) for item in batch],
+                             number=number)
+    report('compiled', compiled, number * args.batch)
+    print("  speedup {:.1f}x".format(rebuilt / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,40 @@ DEBUG = False
 DATABASE_URI = 'sqlite://'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+## Database connections
+# Pool settings, None keeps the driver defaults (MySQL: 10 connections, 10 overflow)
+DATABASE_POOL_SIZE = None
+DATABASE_MAX_OVERFLOW = None
+DATABASE_POOL_TIMEOUT = None   # Seconds to wait for a free connection
+DATABASE_POOL_RECYCLE = 3600   # Seconds, keep below the server's wait_timeout
+DATABASE_POOL_PRE_PING = True  # Test connections on checkout, one extra round trip (not for SQLite)
+DATABASE_REPLICA_URI = None    # Read replica for GET requests, None reads from DATABASE_URI
+DATABASE_REPLICA_WINDOW = 5    # Seconds a user's reads stay on the primary after writing (replica lag)
+DATABASE_REPLICA_REDIS_URL = None  # Redis keeping the recent writes for all worker processes, None: per process
+# SQLite pragmas set on connect, None leaves the SQLite default
+SQLITE_JOURNAL_MODE = 'WAL'    # Ignored for in-memory databases
+SQLITE_SYNCHRONOUS = 'NORMAL'  # Safe with WAL, a crash can only lose the last transactions
+SQLITE_BUSY_TIMEOUT = 5000     # Milliseconds a writer waits for the lock
+
+## ASGI serving mode, for compatibility only (eatme.asgi)
+ASGI_THREADS = 20  # Threads running the views, at most the pool size plus overflow (10 + 10 for MySQL)
+
+## JSON responses
+JSON_BACKEND = 'auto'  # 'orjson', 'stdlib', or 'auto' to use orjson when installed
+JSONIFY_PRETTYPRINT_REGULAR = False
+
+## Request instrumentation
+METRICS_ENABLED = True         # Histograms per endpoint, served on /metrics
+METRICS_PUBLIC = False         # Serve /metrics without authentication, otherwise to admins only
+METRICS_SERVER_TIMING = False  # Send the timings of each request in a Server-Timing header
+METRICS_QUERY_WARNING = 20     # Log requests running more SQL statements
+
+## Response compression
+COMPRESS_MIMETYPES = ['application/json', 'text/html', 'text/css', 'application/javascript']
+COMPRESS_MIN_SIZE = 1024       # Smaller responses are sent uncompressed
+COMPRESS_LEVEL = 6             # gzip level
+COMPRESS_BROTLI_QUALITY = 4    # brotli quality, when brotli is installed
+
 ## Security settings
 SECURITY_TOKEN_AUTHENTICATION_HEADER = 'Authorization'
 SECRET_KEY = 'i-have-not-changed-the-secret-key'
@@ -10,6 +44,12 @@ SECURITY_PASSWORD_SALT = 'i-have-not-changed-the-salt'
 SECURITY_TOKEN_AUTHENTICATION_KEY = 'auth_token'
 SECURITY_TOKEN_MAX_AGE = None
 SECURITY_TRACKABLE = True
+AUTH_TOKEN_CACHE_SIZE = 10000  # Verified tokens kept in memory, 0 disables the cache
+AUTH_TOKEN_CACHE_TTL = 300     # Seconds a verified token skips signature checks, credentials are checked on each hit
+PASSWORD_HASH_ROUNDS = 12      # bcrypt cost, older hashes are rehashed on login
+PASSWORD_HASH_WORKERS = 2      # Hashing processes, 0 hashes on the request thread
+PASSWORD_HASH_QUEUE_MAX = 32   # Pending hashing operations before answering 503
+PASSWORD_HASH_TIMEOUT = 30     # Seconds to wait for a hashing process
 # Note: http://mandarvaze.github.io/2015/01/token-auth-with-flask-security.html
 WTF_CSRF_ENABLED = False
 
@@ -23,4 +63,25 @@ MAIL_PORT = 587
 MAIL_USE_TLS = True
 MAIL_USE_SSL = False
 MAIL_USERNAME = 'username'
-MAIL_PASSWORD = 'password'
\ No newline at end of file
+MAIL_PASSWORD = 'password'
+
+## Pagination
+RECORDS_PAGE_SIZE_MAX = 1000
+USERS_PAGE_SIZE_MAX = 1000
+
+## Batch import
+RECORDS_BATCH_MAX = 10000   # Largest number of records accepted in one batch
+RECORDS_BATCH_CHUNK = 1000  # Records per INSERT statement
+
+## Per-user query result cache
+RESULT_CACHE_BACKEND = 'local'  # 'local', 'shared', or None to disable
+RESULT_CACHE_MAX_ENTRIES = 10000
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Seconds, for the local backend. With several worker processes, writes handled by
+# another worker are only seen after this long: use the shared backend to avoid that.
+RESULT_CACHE_LOCAL_TTL = 5
+RESULT_CACHE_TTL = 300          # Seconds, for the shared backend
+RESULT_CACHE_REDIS_URL = None   # Shared backend server, the in-process stand-in is used if not set
+
+## Export
+RECORDS_EXPORT_CHUNK = 1000  # Records fetched from the database at a time while streaming
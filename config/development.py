@@ -1,2 +1,5 @@
 DEBUG = True
 DATABASE_URI = 'sqlite:////tmp/eatme_dev.db'
+JSONIFY_PRETTYPRINT_REGULAR = True
+PASSWORD_HASH_ROUNDS = 10
+METRICS_SERVER_TIMING = True
@@ -1,2 +1,6 @@
 # in-memory database
 DATABASE_URI = 'sqlite://'
+
+# Cheap password hashing in the request thread
+PASSWORD_HASH_ROUNDS = 4
+PASSWORD_HASH_WORKERS = 0
@@ -0,0 +1,6 @@
+"""
+App instance documented by ``autoflask`` in api.rst
+"""
+from eatme import create_app
+
+app = create_app()
@@ -1,67 +1,120 @@
 """
 EatMe - calories tracking app
 """
-from flask import Flask, g, send_from_directory
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, current_app
 from flask_marshmallow import Marshmallow
 from flask.ext.security import Security, SQLAlchemyUserDatastore
-from flask_mail import Mail
 
-app = Flask(__name__,
-            instance_relative_config=True,
-            static_url_path='/static')
+from .database import SQLAlchemy, init_recent_writes, recent_writes
 
-## Configuration
-# Load the default configuration
-app.config.from_object('config.default')
-
-# Load the configuration from the instance folder
-app.config.from_pyfile('config.py', silent=True)
-
-# Load the file specified by the APP_CONFIG_FILE environment variable
-# Variables defined here will override those in the default configuration
-app.config.from_envvar('APP_CONFIG_FILE', silent=True)
-
-app.config['SQLALCHEMY_DATABASE_URI'] = app.config["DATABASE_URI"]
-db = SQLAlchemy(app)
-ma = Marshmallow(app)
+db = SQLAlchemy()
+ma = Marshmallow()
 
 # Setup Flask-Security
 from .models import User, Role
+from .passwords import LoginForm, init_password_hasher, password_hasher
 
 user_datastore = SQLAlchemyUserDatastore(db, User, Role)
-security = Security(app, user_datastore)
+security = Security()
+
+from .auth import init_token_cache, token_cache
+from .cache import init_result_cache, result_cache
+from .metrics import init_metrics
+
+mail = None
+
+
+def create_app(config=None):
+    """
+    Create the app. ``config`` (a mapping) overrides the configuration files.
+    """
+    app = Flask(__name__,
+                instance_relative_config=True,
+                static_url_path='/static')
+
+    ## Configuration
+    # Load the default configuration
+    app.config.from_object('config.default')
+
+    # Load the configuration from the instance folder
+    app.config.from_pyfile('config.py', silent=True)
+
+    # Load the file specified by the APP_CONFIG_FILE environment variable
+    # Variables defined here will override those in the default configuration
+    app.config.from_envvar('APP_CONFIG_FILE', silent=True)
+
+    if config is not None:
+        app.config.update(config)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = app.config["DATABASE_URI"]
+    app.config['SQLALCHEMY_POOL_SIZE'] = app.config["DATABASE_POOL_SIZE"]
+    app.config['SQLALCHEMY_MAX_OVERFLOW'] = app.config["DATABASE_MAX_OVERFLOW"]
+    app.config['SQLALCHEMY_POOL_TIMEOUT'] = app.config["DATABASE_POOL_TIMEOUT"]
+    app.config['SQLALCHEMY_POOL_RECYCLE'] = app.config["DATABASE_POOL_RECYCLE"]
+    if app.config["DATABASE_REPLICA_URI"]:
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {},
+                                              replica=app.config["DATABASE_REPLICA_URI"])
 
-## Blueprints
-from .api import api
-from .static_pages import static_pages
+    db.init_app(app)
+    init_recent_writes(app)
+    ma.init_app(app)
 
-app.register_blueprint(api)
-app.register_blueprint(static_pages)
+    security_state = security.init_app(app, user_datastore, login_form=LoginForm)
 
-# Add mail service
-# See: https://pythonhosted.org/Flask-Security/quickstart.html#id4
-if app.config['MAIL']:
-    mail = Mail(app)
+    # Hash passwords in a process pool
+    init_password_hasher(app, security_state)
 
+    # Cache verified authentication tokens
+    init_token_cache(app, security_state)
 
-# Create a user to test with
-@app.before_first_request
-def create_user():
+    # Cache per-user query results
+    init_result_cache(app)
+
+    # Instrument requests
+    init_metrics(app, security_state)
+
+    ## Blueprints
+    from .api import api
+    from .static_pages import static_pages
+
+    app.register_blueprint(api)
+    app.register_blueprint(static_pages)
+
+    # Compress responses
+    from .compression import init_compression
+
+    init_compression(app)
+
+    # Add mail service
+    # See: https://pythonhosted.org/Flask-Security/quickstart.html#id4
+    if app.config['MAIL']:
+        from flask_mail import Mail
+
+        global mail
+        mail = Mail(app)
+
+    # An in-memory database only exists in this process, other databases are
+    # created with `manage.py create_db`
+    if app.config['DATABASE_URI'] in ('sqlite://', 'sqlite:///:memory:'):
+        with app.app_context():
+            create_db()
+
+    return app
+
+
+def create_db():
     """
-    Create admin default account on first request if does not exists.
+    Create the missing tables, and the admin account with its roles if it does not exist.
     """
     db.create_all()
-    admin_email = app.config["ADMIN_EMAIL"]
+    admin_email = current_app.config["ADMIN_EMAIL"]
     admin = user_datastore.get_user(admin_email)
     if admin is None:
-        admin_user = user_datastore.create_user(email=admin_email, password=app.config["ADMIN_PASSWORD_HASH"])
-        db.session.commit()
-
-        admin_role = user_datastore.create_role(name="admin", description="Administrator")
-        editor_role = user_datastore.create_role(name="editor", description="Editor")
-        print(admin_role)
-        db.session.commit()
+        admin_user = user_datastore.create_user(email=admin_email, password=current_app.config["ADMIN_PASSWORD_HASH"])
+        admin_role = user_datastore.find_role("admin") or \
+            user_datastore.create_role(name="admin", description="Administrator")
+        editor_role = user_datastore.find_role("editor") or \
+            user_datastore.create_role(name="editor", description="Editor")
         user_datastore.add_role_to_user(admin_user, admin_role)
         user_datastore.add_role_to_user(admin_user, editor_role)
         db.session.commit()
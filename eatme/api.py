@@ -1,13 +1,22 @@
-from datetime import datetime
-from flask import Blueprint, g, jsonify, request
+import csv
+import io
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, current_app, g, request, stream_with_context, url_for
 from flask.ext.security import auth_required, current_user
-from flask.ext.security.utils import encrypt_password
 
-from eatme import db, user_datastore
+from eatme import db, password_hasher, result_cache, token_cache, user_datastore
+from eatme.database import chunked, recent_writes, replica_reads
+from eatme.parsing import parse_date, parse_time
+from eatme.serialization import dumps, jsonify
+import eatme.statistics as statistics
 import eatme.models as models
 
+from sqlalchemy import and_, bindparam, func, or_, select
+
 from flask_inputs import Inputs
-from flask_inputs.validators import JsonSchema
+from eatme.validators import CompiledJsonSchema
 
 
 class InvalidUsage(Exception):
@@ -54,6 +63,129 @@ def handle_invalid_usage(error):
     return response
 
 
+def filtered_records_query(userid):
+    """
+    Records query of a given user, with the ``date_start``, ``date_end``, ``time_start``
+    and ``time_end`` filters of the current request applied.
+    """
+    query = models.Record.query.filter_by(user_id=userid)
+    """ Progressive filtering on time """
+    try:
+        date_start = request.args.get('date_start')
+        if date_start is not None:
+            query = query.filter(models.Record.record_date >= parse_date(date_start))
+        date_end = request.args.get('date_end')
+        if date_end is not None:
+            query = query.filter(models.Record.record_date <= parse_date(date_end))
+        time_start = request.args.get('time_start')
+        if time_start is not None:
+            query = query.filter(models.Record.record_time >= parse_time(time_start))
+        time_end = request.args.get('time_end')
+        if time_end is not None:
+            query = query.filter(models.Record.record_time <= parse_time(time_end))
+    except ValueError:
+        raise InvalidUsage("Invalid query parameters.", status_code=400)
+    return query
+
+
+def encode_cursor(record_date, record_time, record_id):
+    """
+    Opaque pagination cursor pointing at a record in the
+    (record_date, record_time, id) ordering.
+    """
+    raw = '{}|{}|{}'.format(record_date.isoformat(), record_time.isoformat(), record_id)
+    return urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of ``encode_cursor``, returns a (record_date, record_time, id) tuple.
+    """
+    try:
+        raw = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+        record_date, record_time, record_id = raw.split('|')
+        if '.' in record_time:
+            record_time = datetime.strptime(record_time, '%H:%M:%S.%f').time()
+        else:
+            record_time = parse_time(record_time)
+        return parse_date(record_date), record_time, int(record_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidUsage("Invalid cursor.", status_code=400)
+
+
+def seek_before(record_date, record_time, record_id):
+    """
+    Filter for records strictly after the given position in the descending
+    (record_date, record_time, id) ordering.
+    """
+    Record = models.Record
+    return or_(Record.record_date < record_date,
+               and_(Record.record_date == record_date, Record.record_time < record_time),
+               and_(Record.record_date == record_date, Record.record_time == record_time,
+                    Record.id < record_id))
+
+
+def not_modified(etag):
+    """
+    Empty ``304 Not Modified`` response. The ETag is weak if the client's copy is the
+    compressed representation.
+    """
+    response = Response(status=304)
+    response.set_etag(etag, weak=not request.if_none_match.contains(etag))
+    return response
+
+
+def result_cache_lookup(userid):
+    """
+    Key of the current per-user query in the result cache, and the cached response if there is one.
+    """
+    if not result_cache.enabled:
+        return None, None
+    params = [(name, value) for name, value in request.args.items(multi=True) if name != 'auth_token']
+    params.append(('_xhr', request.is_xhr))
+    key = result_cache.key(request.endpoint, userid, params)
+    body = result_cache.get(key)
+    if body is None:
+        return key, None
+    return key, current_app.response_class(body, mimetype='application/json')
+
+
+def result_cache_store(key, response):
+    """
+    Cache the body of a response under the key from ``result_cache_lookup``.
+    """
+    if key is not None:
+        result_cache.set(key, response.get_data())
+    return response
+
+
+def user_data_changed(*user_ids):
+    """
+    Call after committing changes to the data of users: drops their cached results, and
+    keeps reads of their data and by the current user on the primary database while the
+    replica catches up.
+    """
+    for user_id in user_ids:
+        result_cache.invalidate_user(user_id)
+    recent_writes.add(*user_ids)
+    if current_user.is_authenticated:
+        recent_writes.add(current_user.id)
+
+
+def conditional(response):
+    """
+    Add an ETag of the body to a GET response, and turn it into ``304 Not Modified``
+    if the client's ``If-None-Match`` copy is still current. No ``Last-Modified``:
+    the modification times only have one-second resolution.
+    """
+    response.add_etag()
+    """ If-None-Match uses the weak comparison: compressed responses have weak ETags """
+    etag, _ = response.get_etag()
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    return response
+
+
 """
 User API
 """
@@ -62,6 +194,7 @@ User API
 @api.route('/api/v1/users', defaults={'userid': None})
 @api.route('/api/v1/users/<int:userid>')
 @auth_required('token', 'session')
+@replica_reads
 def users(userid):
     """Query users.
 
@@ -96,9 +229,11 @@ def users(userid):
                 "user": {
                     "_links": {
                         "collection": "/api/v1/users",
+                        "daily": "/api/v1/users/2/daily",
                         "records": "/api/v1/users/2/records",
                         "roles": "/api/v1/users/2/roles",
                         "self": "/api/v1/users/2",
+                        "statistics": "/api/v1/users/2/statistics",
                         "targets": "/api/v1/users/2/targets"
                     },
                     "date_created": "2016-04-19T05:39:11+00:00",
@@ -110,16 +245,27 @@ def users(userid):
             }
         }
 
+    When querying the whole list, the following options are available:
+
+    :qparam email_prefix: Only list users whose email address starts with this.
+    :qparam fields: Comma separated list of fields to return, e.g. ``id,email``. Links are only generated if ``_links`` is listed.
+    :qparam limit: Optional page size, defaults to and capped at ``USERS_PAGE_SIZE_MAX``. The response
+                   contains a ``_links.next`` URL while more users remain.
+    :qparam cursor: The ``id`` of the last user of the previous page.
     :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
 
     :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :reqheader If-None-Match: The ``ETag`` of a previous listing response, to only receive the listing if it changed.
+
+    :resheader ETag: Identifies the version of the listing.
 
     :status 200: A correct query with proper authorization
-    :status 400: If a wrong user ID is queried.
+    :status 304: If the listing did not change since the ``If-None-Match`` version.
+    :status 400: If a wrong user ID is queried, or invalid query parameters.
     :status 403: If the current user does not have permission to do the particular query
     """
     if userid is not None:
-        if userid == current_user.id or current_user.has_role('editor') or current_user.has_role('editor'):
+        if userid == current_user.id or current_user.role_names & {'admin', 'editor'}:
             user = models.User.query.filter_by(id=userid).first()
             if user is not None:
                 result = models.user_schema.dump(user)
@@ -129,17 +275,49 @@ def users(userid):
         else:
             raise InvalidUsage("No access to query this user.", status_code=403)
     else:
-        if current_user.has_role('admin') or current_user.has_role('editor'):
-            users = models.User.query.all()
-            if users is not None:
-                result = models.users_schema.dump(users)
-                return jsonify(wrap200code(users=result.data))
-            else:
-                # This should never happen
-                raise jsonify(wrap200code(users=[]))
-        else:
+        if not current_user.role_names & {'admin', 'editor'}:
             raise InvalidUsage("No access to query all users.", status_code=403)
 
+        query = models.User.query
+        email_prefix = request.args.get('email_prefix')
+        if email_prefix:
+            escaped = email_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(models.User.email.like(escaped + '%', escape='\\'))
+
+        fields = request.args.get('fields')
+        if fields is not None:
+            fields = tuple(field for field in fields.split(',') if field)
+            if not fields or not set(fields) <= set(models.UserSchema.Meta.fields):
+                raise InvalidUsage("Invalid query parameters.", status_code=400)
+            schema = models.UserSchema(many=True, only=fields)
+        else:
+            schema = models.users_schema
+
+        """ Keyset pagination on user id, pages of at most USERS_PAGE_SIZE_MAX users """
+        limit = request.args.get('limit')
+        cursor = request.args.get('cursor')
+        links = {}
+        max_limit = current_app.config['USERS_PAGE_SIZE_MAX']
+        try:
+            limit = min(int(limit), max_limit) if limit is not None else max_limit
+            if cursor is not None:
+                query = query.filter(models.User.id > int(cursor))
+        except ValueError:
+            raise InvalidUsage("Invalid query parameters.", status_code=400)
+        if limit < 1:
+            raise InvalidUsage("Invalid query parameters.", status_code=400)
+        users = query.order_by(models.User.id).limit(limit + 1).all()
+        if len(users) > limit:
+            users = users[:limit]
+            """ Never echo a query token back: links are shared through the result cache """
+            args = request.args.to_dict()
+            args.pop('auth_token', None)
+            args.update({'cursor': users[-1].id, 'limit': limit})
+            links['next'] = url_for('api.users', **args)
+
+        result = schema.dump(users)
+        return conditional(jsonify(wrap200code(users=result.data, _links=links)))
+
 
 @api.route('/api/v1/users/self')
 @auth_required('token', 'session')
@@ -171,9 +349,11 @@ def user_self():
             "user": {
               "_links": {
                 "collection": "/api/v1/users",
+                "daily": "/api/v1/users/2/daily",
                 "records": "/api/v1/users/2/records",
                 "roles": "/api/v1/users/2/roles",
                 "self": "/api/v1/users/2",
+                "statistics": "/api/v1/users/2/statistics",
                 "targets": "/api/v1/users/2/targets"
               },
               "date_created": "2016-04-19T05:39:11+00:00",
@@ -233,6 +413,7 @@ def register_user():
     :status 200: When user successfully created
     :status 400: When input data is not validated
     :status 409: When an user with such email address already exists
+    :status 503: When too many passwords are being hashed, retry after ``Retry-After`` seconds
     """
     registration_inputs = RegistrationInputs(request)
     if not registration_inputs.validate():
@@ -242,10 +423,11 @@ def register_user():
         if user_datastore.get_user(input['email']):
             raise InvalidUsage('user already exists', status_code=409)
         else:
-            user = user_datastore.create_user(email=input['email'],
-                                              password=encrypt_password(input['password']))
+            password = password_hasher.encrypt(input['password'])
+            user = user_datastore.create_user(email=input['email'], password=password)
             if user:
                 db.session.commit()
+                user_data_changed(user.id)
         return jsonify(wrap200code(success=True))
 
 
@@ -263,6 +445,7 @@ def manage_user(userid):
 
 @api.route('/api/v1/users/<int:userid>/records', methods=['GET'])
 @auth_required('token', 'session')
+@replica_reads
 def users_records(userid):
     """
     Query records of a specific user.
@@ -307,7 +490,9 @@ def users_records(userid):
                 "record_time": "12:30:00",
                 "user_id": 2
               }
-            ]
+            ],
+            "next_cursor": null,
+            "_links": {}
           }
         }
 
@@ -316,55 +501,471 @@ def users_records(userid):
     :qparam date_end: Date to query equal or before, in RFC 3339 format: 'YYYY-MM-DD', eg. ``2016-04-19``
     :qparam time_start: Time each day to query equal or after, in 'HH:MM' or 'HH:MM:SS' format (24H), eg. ``21:30`` or ``21:30:21``
     :qparam time_end: Time each day to query equal or before, in 'HH:MM' or 'HH:MM:SS' format (24H), eg. ``21:30`` or ``21:30:21``
+    :qparam limit: Optional page size, defaults to and capped at ``RECORDS_PAGE_SIZE_MAX``. The response contains
+                   ``next_cursor`` and a ``_links.next`` URL while more records remain.
+    :qparam cursor: Opaque cursor returned as ``next_cursor`` by the previous page.
     :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
 
     :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
     :status 200: If query successful.
+    :status 304: If the ``If-None-Match`` ``ETag`` still matches the records.
     :status 400: If no such user exists.
     :status 403: If not authorized to query that particular user.
     """
     if userid != current_user.id and not current_user.has_role('editor'):
         raise InvalidUsage("No access to the records of this user.", status_code=403)
 
-    user = models.User.query.filter_by(id=userid).first()
+    user = db.session.query(models.User.id).filter_by(id=userid).first()
+    if user is None:
+        raise InvalidUsage("No such user.", status_code=400)
+
+    cache_key, cached = result_cache_lookup(userid)
+    if cached is not None:
+        return conditional(cached)
+
+    query = filtered_records_query(userid)
+
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+
+    """ Keyset pagination: seek past the cursor instead of using OFFSET """
+    max_limit = current_app.config['RECORDS_PAGE_SIZE_MAX']
+    try:
+        limit = int(limit) if limit is not None else max_limit
+    except ValueError:
+        raise InvalidUsage("Invalid query parameters.", status_code=400)
+    if limit < 1:
+        raise InvalidUsage("Invalid query parameters.", status_code=400)
+    limit = min(limit, max_limit)
+
+    if cursor is not None:
+        query = query.filter(seek_before(*decode_cursor(cursor)))
+
+    # Fetch one extra row to find out whether there is a next page
+    current_records = query.order_by(models.Record.record_date.desc(),
+                                     models.Record.record_time.desc(),
+                                     models.Record.id.desc()).limit(limit + 1).all()
+    has_next = len(current_records) > limit
+    current_records = current_records[:limit]
+
+    links = {}
+    next_cursor = None
+    if has_next:
+        last = current_records[-1]
+        next_cursor = encode_cursor(last.record_date, last.record_time, last.id)
+        """ Never echo a query token back: the cached body is shared by every caller """
+        args = request.args.to_dict()
+        args.pop('auth_token', None)
+        args.update({'cursor': next_cursor, 'limit': limit})
+        links['next'] = url_for('api.users_records', userid=userid, **args)
+    response = jsonify(wrap200code(records=models.dump_records(current_records),
+                                   next_cursor=next_cursor,
+                                   _links=links))
+    return conditional(result_cache_store(cache_key, response))
+
+
+@api.route('/api/v1/users/<int:userid>/records', methods=['DELETE'])
+@auth_required('token', 'session')
+def delete_users_records(userid):
+    """
+    Delete records of a specific user, selected by the same filters as when querying them,
+    by a list of record IDs, or both.
+
+    The records are removed with one ``DELETE`` statement, restricted to the user's records,
+    per chunk of a few hundred IDs.
+
+    .. sourcecode:: http
+
+        DELETE /api/v1/users/2/records?date_start=2016-04-01&date_end=2016-04-30 HTTP/1.0
+        Authorization: TOKEN
+
+    or
+
+    .. sourcecode:: http
+
+        DELETE /api/v1/users/2/records HTTP/1.0
+        Authorization: TOKEN
+        Content-Type: application/json
+
+        {
+            "ids": [12, 13, 27]
+        }
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "deleted": 3
+          }
+        }
+
+    IDs of records that do not exist or belong to another user are ignored, and not counted in ``deleted``.
+
+    :param userid: Which user's records to delete. If not the current user's, then need to have ``editor`` role.
+    :qparam date_start: Delete records on or after this date, in 'YYYY-MM-DD' format, eg. ``2016-04-19``
+    :qparam date_end: Delete records on or before this date, in 'YYYY-MM-DD' format, eg. ``2016-04-19``
+    :qparam time_start: Delete records at or after this time of the day, in 'HH:MM' or 'HH:MM:SS' format (24H)
+    :qparam time_end: Delete records at or before this time of the day, in 'HH:MM' or 'HH:MM:SS' format (24H)
+    :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :status 200: With the number of deleted records.
+    :status 400: If no filter nor ``ids`` is given, or they are invalid.
+    :status 403: If not authorized to delete the records of that particular user.
+    """
+    if userid != current_user.id and not current_user.has_role('editor'):
+        raise InvalidUsage("No access to the records of this user.", status_code=403)
+
+    ids = None
+    if request.get_data():
+        delete_records_inputs = DeleteRecordsInputs(request)
+        if not delete_records_inputs.validate():
+            raise InvalidUsage(delete_records_inputs.errors, status_code=400)
+        ids = request.json['ids']
+        if len(ids) > current_app.config['RECORDS_BATCH_MAX']:
+            raise InvalidUsage("Too many records in one batch.", status_code=400)
+        if not ids:
+            return jsonify(wrap200code(deleted=0))
+
+    filters = ('date_start', 'date_end', 'time_start', 'time_end')
+    if ids is None and not any(name in request.args for name in filters):
+        raise InvalidUsage("A filter or a list of record IDs is required.", status_code=400)
+
+    query = filtered_records_query(userid)
+    if ids is None:
+        queries = [query]
+    else:
+        queries = [query.filter(models.Record.id.in_(ids_chunk)) for ids_chunk in chunked(ids)]
+
+    """ Daily totals of the deleted records' date range are rebuilt from the remaining records """
+    deleted, dates = 0, []
+    for chunk_query in queries:
+        first_date, last_date = chunk_query.with_entities(func.min(models.Record.record_date),
+                                                          func.max(models.Record.record_date)).one()
+        deleted += chunk_query.delete(synchronize_session=False)
+        if first_date is not None:
+            dates += [first_date, last_date]
+    if deleted and dates:
+        models.DailyTotal.rebuild(user_id=userid, date_start=min(dates), date_end=max(dates))
+    db.session.commit()
+    if deleted:
+        user_data_changed(userid)
+    return jsonify(wrap200code(deleted=deleted))
+
+
+@api.route('/api/v1/users/<int:userid>/records/export', methods=['GET'])
+@auth_required('token', 'session')
+@replica_reads
+def users_records_export(userid):
+    """
+    Export all records of a specific user, streamed as newline delimited JSON or CSV.
+
+    Records are read from the database in chunks and sent as they are read, so the full
+    history is never held in memory.
+
+    .. sourcecode:: http
+
+        GET /api/v1/users/2/records/export?format=csv HTTP/1.0
+        Authorization: TOKEN
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: text/csv; charset=utf-8
+        Content-Disposition: attachment; filename=records-2.csv
+
+        id,date_created,date_modified,record_date,record_time,description,calories,user_id
+        2,2016-04-19T05:43:02+00:00,2016-04-19T05:49:03+00:00,2016-04-19,19:15:00,Sandwich,150,2
+        1,2016-04-19T05:41:17+00:00,2016-04-19T05:41:17+00:00,2016-04-12,12:30:00,Sandwich,120,2
+
+    :param userid: Which user's records to export. If not the current user's, then need to have ``editor`` role.
+    :qparam format: ``ndjson`` (default) or ``csv``.
+    :qparam date_start: Date to query equal or after, in RFC 3339 format: 'YYYY-MM-DD', eg. ``2016-04-19``
+    :qparam date_end: Date to query equal or before, in RFC 3339 format: 'YYYY-MM-DD', eg. ``2016-04-19``
+    :qparam time_start: Time each day to query equal or after, in 'HH:MM' or 'HH:MM:SS' format (24H), eg. ``21:30`` or ``21:30:21``
+    :qparam time_end: Time each day to query equal or before, in 'HH:MM' or 'HH:MM:SS' format (24H), eg. ``21:30`` or ``21:30:21``
+    :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :status 200: If query successful.
+    :status 400: If no such user exists, or invalid query parameters.
+    :status 403: If not authorized to query that particular user.
+    """
+    if userid != current_user.id and not current_user.has_role('editor'):
+        raise InvalidUsage("No access to the records of this user.", status_code=403)
+
+    user = db.session.query(models.User.id).filter_by(id=userid).first()
+    if user is None:
+        raise InvalidUsage("No such user.", status_code=400)
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        raise InvalidUsage("Invalid export format.", status_code=400)
+
+    query = filtered_records_query(userid) \
+        .order_by(models.Record.record_date.desc(),
+                  models.Record.record_time.desc(),
+                  models.Record.id.desc()) \
+        .yield_per(current_app.config['RECORDS_EXPORT_CHUNK'])
+    fields = models.RecordSchema.Meta.fields
+
+    def generate_ndjson():
+        for record in query:
+            yield dumps(models.record_to_dict(record)) + b'\n'
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        for record in query:
+            data = models.record_to_dict(record)
+            writer.writerow([data[field] for field in fields])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if export_format == 'csv':
+        response = Response(stream_with_context(generate_csv()), mimetype='text/csv')
+    else:
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=records-{}.{}'.format(userid, export_format)
+    return response
+
+
+@api.route('/api/v1/users/<int:userid>/daily', methods=['GET'])
+@auth_required('token', 'session')
+@replica_reads
+def users_daily(userid):
+    """
+    Query daily calories totals of a specific user, compared to the user's daily target.
+
+    Totals are computed in the database, only one row per day is returned.
+
+    .. sourcecode:: http
+
+        GET /api/v1/users/2/daily?date_start=2016-04-12 HTTP/1.0
+        Authorization: TOKEN
+        Accept: application/json
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "daily": [
+              {
+                "calories": 1350,
+                "over_target": true,
+                "record_count": 3,
+                "record_date": "2016-04-19"
+              },
+              {
+                "calories": 120,
+                "over_target": false,
+                "record_count": 1,
+                "record_date": "2016-04-12"
+              }
+            ],
+            "target_daily_calories": 1200
+          }
+        }
+
+    :param userid: Which user's totals to query. If not the current user's, then need to have ``editor`` role.
+    :qparam date_start: Date to query equal or after, in RFC 3339 format: 'YYYY-MM-DD', eg. ``2016-04-19``
+    :qparam date_end: Date to query equal or before, in RFC 3339 format: 'YYYY-MM-DD', eg. ``2016-04-19``
+    :qparam time_start: Only count records each day equal or after this time, in 'HH:MM' or 'HH:MM:SS' format (24H)
+    :qparam time_end: Only count records each day equal or before this time, in 'HH:MM' or 'HH:MM:SS' format (24H)
+    :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :status 200: If query successful.
+    :status 400: If no such user exists, or invalid query parameters.
+    :status 403: If not authorized to query that particular user.
+    """
+    if userid != current_user.id and not current_user.has_role('editor'):
+        raise InvalidUsage("No access to the records of this user.", status_code=403)
+
+    user = db.session.query(models.User.target_daily_calories).filter_by(id=userid).first()
+    if user is None:
+        raise InvalidUsage("No such user.", status_code=400)
+
+    cache_key, cached = result_cache_lookup(userid)
+    if cached is not None:
+        return cached
+
+    target = user.target_daily_calories or 0
+    if request.args.get('time_start') is None and request.args.get('time_end') is None:
+        """ Whole days are requested, read the maintained daily totals """
+        DailyTotal = models.DailyTotal
+        query = DailyTotal.query.filter_by(user_id=userid)
+        try:
+            date_start = request.args.get('date_start')
+            if date_start is not None:
+                query = query.filter(DailyTotal.record_date >= parse_date(date_start))
+            date_end = request.args.get('date_end')
+            if date_end is not None:
+                query = query.filter(DailyTotal.record_date <= parse_date(date_end))
+        except ValueError:
+            raise InvalidUsage("Invalid query parameters.", status_code=400)
+        totals = query.with_entities(DailyTotal.record_date,
+                                     DailyTotal.calories_sum,
+                                     DailyTotal.record_count) \
+            .order_by(DailyTotal.record_date.desc()) \
+            .all()
+    else:
+        """ Partial days need summing up the matching records """
+        query = filtered_records_query(userid)
+        totals = query.with_entities(models.Record.record_date,
+                                     func.sum(models.Record.calories),
+                                     func.count(models.Record.id)) \
+            .group_by(models.Record.record_date) \
+            .order_by(models.Record.record_date.desc()) \
+            .all()
+    daily = [{'record_date': record_date.isoformat(),
+              'calories': int(calories or 0),
+              'record_count': record_count,
+              'over_target': int(calories or 0) > target}
+             for record_date, calories, record_count in totals]
+    return result_cache_store(cache_key, jsonify(wrap200code(daily=daily, target_daily_calories=target)))
+
+
+@api.route('/api/v1/users/<int:userid>/statistics', methods=['GET'])
+@auth_required('token', 'session')
+@replica_reads
+def users_statistics(userid):
+    """
+    Calories statistics of a specific user: 7 and 30 days rolling averages, weekly and monthly
+    totals, percentiles of the daily calories and the share of days over the daily target.
+
+    Computed from the daily totals in one pass, so ranges of many years are fine. Averages and
+    shares are per logged day, days without records are not counted. All series are in
+    ascending date order.
+
+    .. sourcecode:: http
+
+        GET /api/v1/users/2/statistics?date_start=2016-04-11&series=rolling,weekly HTTP/1.0
+        Authorization: TOKEN
+        Accept: application/json
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "statistics": {
+              "average": 1775.0,
+              "calories": 3550,
+              "days": 2,
+              "days_over_target": 1,
+              "percentiles": {
+                "p10": 1350,
+                "p50": 1350,
+                "p90": 2200
+              },
+              "rolling": [
+                {
+                  "average_30d": 1350,
+                  "average_7d": 1350,
+                  "calories": 1350,
+                  "record_date": "2016-04-12"
+                },
+                {
+                  "average_30d": 1775,
+                  "average_7d": 2200,
+                  "calories": 2200,
+                  "record_date": "2016-04-19"
+                }
+              ],
+              "share_over_target": 0.5,
+              "target_daily_calories": 2000,
+              "weekly": [
+                {
+                  "calories": 1350,
+                  "days": 1,
+                  "week_start": "2016-04-11"
+                },
+                {
+                  "calories": 2200,
+                  "days": 1,
+                  "week_start": "2016-04-18"
+                }
+              ]
+            }
+          }
+        }
+
+    :param userid: Which user's statistics to query. If not the current user's, then need to have ``editor`` role.
+    :qparam date_start: Days equal or after, in RFC 3339 format: 'YYYY-MM-DD', eg. ``2016-04-19``.
+                        The rolling averages of the first days include the days before.
+    :qparam date_end: Days equal or before, in RFC 3339 format: 'YYYY-MM-DD', eg. ``2016-04-19``
+    :qparam series: Comma separated list of the series to return, out of ``rolling``, ``weekly`` and
+                    ``monthly`` (the default is all). The summary is always returned.
+    :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :status 200: If query successful.
+    :status 304: If the ``If-None-Match`` ``ETag`` still matches the statistics.
+    :status 400: If no such user exists, or invalid query parameters.
+    :status 403: If not authorized to query that particular user.
+    """
+    if userid != current_user.id and not current_user.has_role('editor'):
+        raise InvalidUsage("No access to the records of this user.", status_code=403)
+
+    cache_key, cached = result_cache_lookup(userid)
+    if cached is not None:
+        return conditional(cached)
+
+    """ Only the target is needed, skip loading the user with its roles """
+    user = db.session.query(models.User.target_daily_calories).filter_by(id=userid).first()
     if user is None:
         raise InvalidUsage("No such user.", status_code=400)
 
-    # Apply filtering
-    kwargs = {'user_id': userid}
-    query = models.Record.query.filter_by(**kwargs)
-    """ Progressive filtering on time """
     try:
         date_start = request.args.get('date_start')
-        if date_start is not None:
-            query_date_start = datetime.strptime(date_start, '%Y-%m-%d').date()
-            query = query.filter(models.Record.record_date >= query_date_start)
+        date_start = parse_date(date_start) if date_start is not None else None
         date_end = request.args.get('date_end')
-        if date_end is not None:
-            query_date_end = datetime.strptime(date_end, '%Y-%m-%d').date()
-            query = query.filter(models.Record.record_date <= query_date_end)
-        time_start = request.args.get('time_start')
-        if time_start is not None:
-            if len(time_start) < 6:
-                time_start += ':00'
-            query_time_start = datetime.strptime(time_start, '%H:%M:%S').time()
-            query = query.filter(models.Record.record_time >= query_time_start)
-        time_end = request.args.get('time_end')
-        if time_end is not None:
-            if len(time_end) < 6:
-                time_end += ':00'
-            query_time_end = datetime.strptime(time_end, '%H:%M:%S').time()
-            query = query.filter(models.Record.record_time <= query_time_end)
+        date_end = parse_date(date_end) if date_end is not None else None
     except ValueError:
         raise InvalidUsage("Invalid query parameters.", status_code=400)
+    series = request.args.get('series')
+    series = statistics.SERIES if series is None else tuple(series.split(','))
+    if not set(series) <= set(statistics.SERIES):
+        raise InvalidUsage("Invalid query parameters.", status_code=400)
 
-    current_records = query.order_by(models.Record.record_date.desc(), models.Record.record_time.desc()).all()
-    result = models.records_schema.dump(current_records)
-    return jsonify(wrap200code(records=result.data))
+    table = models.DailyTotal.__table__
+    query = select([table.c.record_date, table.c.calories_sum]) \
+        .where(table.c.user_id == userid) \
+        .order_by(table.c.record_date)
+    if date_start is not None:
+        query = query.where(table.c.record_date > date_start - timedelta(days=statistics.ROLLING_DAYS))
+    if date_end is not None:
+        query = query.where(table.c.record_date <= date_end)
+    rows = db.session.execute(query)
+    batches = iter(lambda: rows.fetchmany(1000), [])
+    result = statistics.calories_statistics(batches, user.target_daily_calories or 0,
+                                            date_start=date_start, series=series)
+    return conditional(result_cache_store(cache_key, jsonify(wrap200code(statistics=result))))
 
 
 @api.route('/api/v1/users/<int:userid>/targets', methods=['GET', 'PUT'])
 @auth_required('token', 'session')
+@replica_reads
 def users_targets(userid):
     """Query or update user targets, such as daily calories goals.
 
@@ -435,6 +1036,7 @@ def users_targets(userid):
 
     :param userid: the id of user being queried or modified. For modifying a different user than the one logged in needs ``editor`` rote.
     :status 200: Successful query
+    :status 304: If the client's copy is still current, per ``If-None-Match``.
     :status 400: If no user exists who correspond to the one queried
     :status 401: If not authenticated (not logged in)
     :status 403: If not authorized
@@ -442,20 +1044,25 @@ def users_targets(userid):
     if userid != current_user.id and not current_user.has_role('editor'):
         raise InvalidUsage("No access to the records of this user.", status_code=403)
 
-    user = models.User.query.filter_by(id=userid).first()
-    if user is None:
-        raise InvalidUsage("No such user.", status_code=400)
-
+    User = models.User
     if request.method == 'GET':
+        user = db.session.query(User.id, User.target_daily_calories).filter_by(id=userid).first()
+        if user is None:
+            raise InvalidUsage("No such user.", status_code=400)
         result = models.target_schema.dump(user)
-        return jsonify(wrap200code(targets=result.data))
+        return conditional(jsonify(wrap200code(targets=result.data)))
     elif request.method == 'PUT':
         target_inputs = TargetInputs(request)
         if not target_inputs.validate():
             raise InvalidUsage(target_inputs.errors, status_code=400)
         target_json = request.json
-        user.target_daily_calories = int(target_json['target_daily_calories'])
+        updated = User.query.filter_by(id=userid) \
+            .update({User.target_daily_calories: int(target_json['target_daily_calories'])},
+                    synchronize_session=False)
+        if not updated:
+            raise InvalidUsage("No such user.", status_code=400)
         db.session.commit()
+        user_data_changed(userid)
         return jsonify(wrap200code(settings=target_json))
     else:
         raise InvalidUsage("Method not allowed (only GET and PUT)", status_code=405)
@@ -580,10 +1187,7 @@ def users_roles(userid):
     possible_roles = ['admin', 'editor']
 
     if request.method == 'GET':
-        this_user_roles = []
-        for role in possible_roles:
-            if user.has_role(role):
-                this_user_roles += [role]
+        this_user_roles = [role for role in possible_roles if role in user.role_names]
         return jsonify(wrap200code(roles=this_user_roles))
     elif request.method == 'PUT':
         role_input = RoleInputs(request)
@@ -595,6 +1199,7 @@ def users_roles(userid):
             raise InvalidUsage("No applicable role found", status_code=400)
         user_datastore.add_role_to_user(user, role)
         db.session.commit()
+        user_data_changed(user.id)
         return jsonify(wrap200code(settings=role_json))
     elif request.method == 'DELETE':
         role_input = RoleInputs(request)
@@ -606,11 +1211,111 @@ def users_roles(userid):
             raise InvalidUsage("No applicable role found", status_code=400)
         user_datastore.remove_role_from_user(user, role)
         db.session.commit()
+        user_data_changed(user.id)
         return jsonify(wrap200code(settings=role_json))
     else:
         raise InvalidUsage("Method not allowed (only GET/PUT/DELETE)", status_code=405)
 
 
+@api.route('/api/v1/auth/token-cache', methods=['GET'])
+@auth_required('token', 'session')
+def auth_token_cache():
+    """Query the authentication token cache counters
+
+    Only available to users with the ``admin`` role.
+
+    **Example request:**
+
+    .. sourcecode:: http
+
+        GET /api/v1/auth/token-cache HTTP/1.0
+        Authorization: TOKEN
+
+    **Example response:**
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "token_cache": {
+              "evictions": 0,
+              "hit_ratio": 0.95,
+              "hits": 190,
+              "invalidations": 1,
+              "max_size": 10000,
+              "misses": 10,
+              "size": 9,
+              "ttl": 300
+            }
+          }
+        }
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :status 200: Successful query
+    :status 403: If not an administrator
+    """
+    if not current_user.has_role('admin'):
+        raise InvalidUsage("Only administrators have access to the token cache.", status_code=403)
+    return jsonify(wrap200code(token_cache=token_cache.stats()))
+
+
+@api.route('/api/v1/cache/results', methods=['GET'])
+@auth_required('token', 'session')
+def results_cache():
+    """Query the per-user result cache counters and memory footprint
+
+    Only available to users with the ``admin`` role.
+
+    **Example request:**
+
+    .. sourcecode:: http
+
+        GET /api/v1/cache/results HTTP/1.0
+        Authorization: TOKEN
+
+    **Example response:**
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "result_cache": {
+              "backend": "LRUBackend",
+              "bytes": 48213,
+              "enabled": true,
+              "entries": 12,
+              "evictions": 0,
+              "hit_ratio": 0.75,
+              "hits": 36,
+              "max_bytes": 67108864,
+              "max_entries": 10000,
+              "misses": 12,
+              "ttl": 5
+            }
+          }
+        }
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :status 200: Successful query
+    :status 403: If not an administrator
+    """
+    if not current_user.has_role('admin'):
+        raise InvalidUsage("Only administrators have access to the result cache.", status_code=403)
+    return jsonify(wrap200code(result_cache=result_cache.stats()))
+
+
 """
 Records API
 """
@@ -690,17 +1395,12 @@ def add_record():
             raise InvalidUsage("Invalid user", status_code=400)
 
         try:
-            record_date = datetime.strptime(input['record_date'], '%Y-%m-%d').date()
+            record_date = parse_date(input['record_date'])
         except ValueError:
             raise InvalidUsage("Invalid date given", status_code=400)
 
         try:
-            if len(input['record_time']) > 5:
-                """ Use full time format: 12:30:45 """
-                record_time = datetime.strptime(input['record_time'], '%H:%M:%S').time()
-            else:
-                """ Use hour/minute time format: 12:30 """
-                record_time = datetime.strptime(input['record_time'], '%H:%M').time()
+            record_time = parse_time(input['record_time'])
         except ValueError:
             raise InvalidUsage("Invalid time given", status_code=400)
 
@@ -710,13 +1410,159 @@ def add_record():
                                    record_time=record_time,
                                    description=input['description'])
         db.session.add(new_record)
+        models.DailyTotal.adjust(new_record.user_id, new_record.record_date, new_record.calories, 1)
         db.session.commit()
+        user_data_changed(new_record.user_id)
         results = models.record_schema.dump(new_record)
         return jsonify(wrap200code(new_record=results.data))
 
 
+# Placeholder of the NDJSON lines that could not be decoded, already reported as errors
+INVALID_LINE = object()
+
+
+@api.route('/api/v1/records/batch', methods=['POST'])
+@auth_required('token', 'session')
+def add_records_batch():
+    """Create many records at once
+
+    Takes a JSON array of records in the same format as for `/api/v1/records <#post--api-v1-records>`_,
+    or newline delimited JSON (one record per line) with ``Content-Type: application/x-ndjson``.
+    Every valid record is inserted, invalid ones are reported by their position in the batch.
+
+    **Example batch request:**
+
+    .. sourcecode:: http
+
+        POST /api/v1/records/batch HTTP/1.0
+        Authorization: TOKEN
+        Content-Type: application/json
+
+        [
+            {
+                "record_date": "2016-04-12",
+                "record_time": "12:30",
+                "calories": 120,
+                "description": "Sandwich",
+                "userid": 2
+            },
+            {
+                "record_date": "2016-04-32",
+                "record_time": "19:00",
+                "calories": 450,
+                "description": "Pizza",
+                "userid": 2
+            }
+        ]
+
+    **Example batch response:**
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "errors": [
+              {
+                "index": 1,
+                "message": "Invalid date given"
+              }
+            ],
+            "inserted": 1
+          }
+        }
+
+    :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+    :reqheader Content-Type: ``application/json`` for a JSON array, ``application/x-ndjson`` for one record per line.
+
+    :status 200: If the batch was processed, see ``errors`` for the records not added
+    :status 400: If the body is not a list of records, or larger than ``RECORDS_BATCH_MAX``
+    """
+    errors = []
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for index, line in enumerate(request.get_data(as_text=True).splitlines()):
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(INVALID_LINE)
+                errors.append({'index': index, 'message': "Invalid JSON"})
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            raise InvalidUsage("A list of records is required.", status_code=400)
+    if len(items) > current_app.config['RECORDS_BATCH_MAX']:
+        raise InvalidUsage("Too many records in one batch.", status_code=400)
+
+    is_editor = current_user.has_role('editor')
+    userids = set(item['userid'] for item in items
+                  if isinstance(item, dict) and isinstance(item.get('userid'), int))
+    existing_userids = set()
+    for userids_chunk in chunked(userids):
+        existing_userids.update(userid for (userid,) in
+                                db.session.query(models.User.id).filter(models.User.id.in_(userids_chunk)))
+
+    rows = []
+    for index, item in enumerate(items):
+        if item is INVALID_LINE:
+            continue
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'message': "A record must be a JSON object."})
+            continue
+        validation_errors = [error.message for error in new_record_validator.iter_errors(item)]
+        if validation_errors:
+            errors.append({'index': index, 'message': validation_errors})
+            continue
+        if item['userid'] != current_user.id and not is_editor:
+            errors.append({'index': index, 'message': "No access to add records to this user."})
+            continue
+        if item['userid'] not in existing_userids:
+            errors.append({'index': index, 'message': "Invalid user"})
+            continue
+        try:
+            record_date = parse_date(item['record_date'])
+        except ValueError:
+            errors.append({'index': index, 'message': "Invalid date given"})
+            continue
+        try:
+            record_time = parse_time(item['record_time'])
+        except ValueError:
+            errors.append({'index': index, 'message': "Invalid time given"})
+            continue
+        rows.append({'user_id': item['userid'],
+                     'calories': int(item['calories']),
+                     'record_date': record_date,
+                     'record_time': record_time,
+                     'description': item.get('description')})
+
+    chunk_size = current_app.config['RECORDS_BATCH_CHUNK']
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(models.Record.__table__.insert(), rows[start:start + chunk_size])
+
+    """ Recompute the daily totals of each user over the imported dates, set-based """
+    date_ranges = {}
+    for row in rows:
+        first, last = date_ranges.get(row['user_id'], (row['record_date'], row['record_date']))
+        date_ranges[row['user_id']] = (min(first, row['record_date']), max(last, row['record_date']))
+    for user_id, (first, last) in date_ranges.items():
+        models.DailyTotal.rebuild(user_id=user_id, date_start=first, date_end=last)
+    db.session.commit()
+    user_data_changed(*set(row['user_id'] for row in rows))
+
+    errors.sort(key=lambda error: error['index'])
+    return jsonify(wrap200code(inserted=len(rows), errors=errors))
+
+
 @api.route('/api/v1/records/<int:recordid>', methods=['GET', 'PUT', 'DELETE'])
 @auth_required('token', 'session')
+@replica_reads
 def records(recordid):
     """Query and modify records
 
@@ -799,6 +1645,7 @@ def records(recordid):
 
     :param recordid: Which record to modify.
     :status 200: Successfully processed the query
+    :status 304: If the client's copy is still current, per ``If-None-Match``.
     :status 400: Incorrect query.
     :status 403: No permission to alter a record associated with another user (e.g. not an ``editor``)
     """
@@ -811,29 +1658,25 @@ def records(recordid):
 
     if request.method == 'GET':
         result = models.record_schema.dump(record)
-        return jsonify(wrap200code(targets=result.data))
+        return conditional(jsonify(wrap200code(targets=result.data)))
     elif request.method == 'PUT':
         updated_records_inputs = UpdatedRecordInputs(request)
         if not updated_records_inputs.validate():
             raise InvalidUsage(updated_records_inputs.errors, status_code=400)
         update_json = request.json
+        old_date, old_calories = record.record_date, record.calories
         if 'calories' in update_json:
             record.calories = int(update_json['calories'])
         if 'record_date' in update_json:
             try:
-                record_date = datetime.strptime(update_json['record_date'], '%Y-%m-%d').date()
+                record_date = parse_date(update_json['record_date'])
             except ValueError:
                 raise InvalidUsage("Invalid date given", status_code=400)
             record.record_date = record_date
 
         if 'record_time' in update_json:
             try:
-                if len(update_json['record_time']) > 5:
-                    """ Use full time format: 12:30:45 """
-                    record_time = datetime.strptime(update_json['record_time'], '%H:%M:%S').time()
-                else:
-                    """ Use hour/minute time format: 12:30 """
-                    record_time = datetime.strptime(update_json['record_time'], '%H:%M').time()
+                record_time = parse_time(update_json['record_time'])
             except ValueError:
                 raise InvalidUsage("Invalid time given", status_code=400)
             record.record_time = record_time
@@ -841,17 +1684,286 @@ def records(recordid):
         if 'description' in update_json:
             record.description = update_json['description']
 
+        if record.record_date != old_date:
+            models.DailyTotal.adjust(record.user_id, old_date, -old_calories, -1)
+            models.DailyTotal.adjust(record.user_id, record.record_date, record.calories, 1)
+        elif record.calories != old_calories:
+            models.DailyTotal.adjust(record.user_id, record.record_date, record.calories - old_calories, 0)
         db.session.commit()
+        user_data_changed(record.user_id)
         result = models.record_schema.dump(record)
         return jsonify(wrap200code(record=result.data))
     elif request.method == 'DELETE':
+        models.DailyTotal.adjust(record.user_id, record.record_date, -record.calories, -1)
+        user_id = record.user_id
         db.session.delete(record)
         db.session.commit()
+        user_data_changed(user_id)
         return jsonify(wrap200code(deleted=True))
     else:
         raise InvalidUsage("Method not allowed (only GET and PUT)", status_code=405)
 
 
+def record_patch_values(patch):
+    """
+    Column values of a validated record patch.
+    """
+    values = {}
+    if 'calories' in patch:
+        values['calories'] = int(patch['calories'])
+    if 'record_date' in patch:
+        try:
+            values['record_date'] = parse_date(patch['record_date'])
+        except ValueError:
+            raise InvalidUsage("Invalid date given", status_code=400)
+    if 'record_time' in patch:
+        try:
+            values['record_time'] = parse_time(patch['record_time'])
+        except ValueError:
+            raise InvalidUsage("Invalid time given", status_code=400)
+    if 'description' in patch:
+        values['description'] = patch['description']
+    return values
+
+
+def record_update_statement(returning=False):
+    """
+    ``UPDATE`` of the record with the ``_id`` parameter, restricted to the current user's
+    records unless they are an ``editor``. The columns to set are the other parameters.
+    """
+    table = models.Record.__table__
+    statement = table.update().where(table.c.id == bindparam('_id'))
+    if not current_user.has_role('editor'):
+        statement = statement.where(table.c.user_id == current_user.id)
+    if returning:
+        statement = statement.returning(*table.c)
+    return statement
+
+
+def record_access_error(recordid):
+    """
+    Error for a record that could not be updated: it does not exist, or it is someone else's.
+    """
+    table = models.Record.__table__
+    if db.session.execute(select([table.c.user_id]).where(table.c.id == recordid)).first() is None:
+        return InvalidUsage("No such record.", status_code=400)
+    return InvalidUsage("No access to the records of this user.", status_code=403)
+
+
+@api.route('/api/v1/records/<int:recordid>', methods=['PATCH'])
+@auth_required('token', 'session')
+def patch_record(recordid):
+    """Modify a record in place
+
+    Same as modifying a record with ``PUT``, but the record is updated with a single ``UPDATE``
+    statement instead of being loaded first. On databases supporting it, the updated record is
+    returned by the same statement (``RETURNING``).
+
+    **Example request:**
+
+    .. sourcecode:: http
+
+        PATCH /api/v1/records/17 HTTP/1.0
+        Authorization: TOKEN
+
+        {
+            "calories": 150
+        }
+
+    **Example response:**
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "record": {
+              "calories": 150,
+              "date_created": "2016-04-19T15:47:49+00:00",
+              "date_modified": "2016-04-19T16:02:05+00:00",
+              "description": "Sandwich",
+              "id": 17,
+              "record_date": "2016-04-12",
+              "record_time": "12:30:00",
+              "user_id": 2
+            }
+          }
+        }
+
+    :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+
+    :param recordid: Which record to modify.
+    :status 200: Successfully modified the record
+    :status 400: Incorrect query, or no such record.
+    :status 403: No permission to alter a record associated with another user (e.g. not an ``editor``)
+    """
+    updated_records_inputs = UpdatedRecordInputs(request)
+    if not updated_records_inputs.validate():
+        raise InvalidUsage(updated_records_inputs.errors, status_code=400)
+    values = record_patch_values(request.json)
+
+    table = models.Record.__table__
+    old_date = None
+    if 'record_date' in values:
+        """ The daily total of the old date changes too """
+        old = db.session.execute(select([table.c.user_id, table.c.record_date])
+                                 .where(table.c.id == recordid)).first()
+        if old is None:
+            raise InvalidUsage("No such record.", status_code=400)
+        old_date = old.record_date
+
+    row = None
+    if values:
+        returning = db.session.get_bind().dialect.implicit_returning
+        result = db.session.execute(record_update_statement(returning), dict(values, _id=recordid))
+        if returning:
+            row = result.first()
+        elif result.rowcount:
+            row = db.session.execute(select([table]).where(table.c.id == recordid)).first()
+    else:
+        row = db.session.execute(select([table]).where(table.c.id == recordid)).first()
+        if row is not None and row.user_id != current_user.id and not current_user.has_role('editor'):
+            row = None
+    if row is None:
+        db.session.rollback()
+        raise record_access_error(recordid)
+
+    if 'record_date' in values or 'calories' in values:
+        models.DailyTotal.rebuild(user_id=row.user_id,
+                                  dates=set(date for date in (old_date, row.record_date) if date is not None))
+    db.session.commit()
+    if values:
+        user_data_changed(row.user_id)
+    return jsonify(wrap200code(record=models.record_to_dict(row)))
+
+
+@api.route('/api/v1/records', methods=['PATCH'])
+@auth_required('token', 'session')
+def patch_records():
+    """Modify many records at once
+
+    Takes a JSON array of patches, each with the ``id`` of a record and the fields to modify,
+    as for `PATCH /api/v1/records/(int:recordid) <#patch--api-v1-records-(int-recordid)>`_.
+    Patches setting the same fields are run as one ``UPDATE`` statement executed with many
+    parameter sets. Invalid patches are reported by their position in the list, the others
+    are applied.
+
+    **Example request:**
+
+    .. sourcecode:: http
+
+        PATCH /api/v1/records HTTP/1.0
+        Authorization: TOKEN
+        Content-Type: application/json
+
+        [
+            {"id": 17, "calories": 150},
+            {"id": 18, "calories": 420},
+            {"id": 21, "record_date": "2016-04-13", "record_time": "08:15"},
+            {"id": 5000, "calories": 100}
+        ]
+
+    **Example response:**
+
+    .. sourcecode:: http
+
+        HTTP/1.0 200 OK
+        Content-Type: application/json
+
+        {
+          "meta": {
+            "code": 200
+          },
+          "response": {
+            "errors": [
+              {
+                "index": 3,
+                "message": "No such record."
+              }
+            ],
+            "updated": 3
+          }
+        }
+
+    :qparam auth_token: Optional token for authentication if no :http:header:`Authorization` nor session cookie is sent.
+
+    :reqheader Authorization: Optional token for authentication if no ``auth_token`` nor session cookie is sent.
+
+    :status 200: If the patches were processed, see ``errors`` for the ones not applied
+    :status 400: If the body is not a list of patches, or larger than ``RECORDS_BATCH_MAX``
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise InvalidUsage("A list of record patches is required.", status_code=400)
+    if len(items) > current_app.config['RECORDS_BATCH_MAX']:
+        raise InvalidUsage("Too many records in one batch.", status_code=400)
+
+    table = models.Record.__table__
+    recordids = set(item['id'] for item in items if isinstance(item, dict) and isinstance(item.get('id'), int))
+    existing = {}
+    for recordids_chunk in chunked(recordids):
+        existing.update((recordid, (user_id, record_date)) for recordid, user_id, record_date in db.session.execute(
+            select([table.c.id, table.c.user_id, table.c.record_date]).where(table.c.id.in_(recordids_chunk))))
+
+    is_editor = current_user.has_role('editor')
+    errors = []
+    seen = set()
+    groups = {}
+    changed_days = {}
+    changed_users = set()
+    for index, item in enumerate(items):
+        validation_errors = [error.message for error in record_patch_validator.iter_errors(item)]
+        if validation_errors:
+            errors.append({'index': index, 'message': validation_errors})
+            continue
+        recordid = item['id']
+        if recordid not in existing:
+            errors.append({'index': index, 'message': "No such record."})
+            continue
+        if recordid in seen:
+            errors.append({'index': index, 'message': "Record patched more than once."})
+            continue
+        user_id, old_date = existing[recordid]
+        if user_id != current_user.id and not is_editor:
+            errors.append({'index': index, 'message': "No access to the records of this user."})
+            continue
+        try:
+            values = record_patch_values(item)
+        except InvalidUsage as error:
+            errors.append({'index': index, 'message': error.message})
+            continue
+        seen.add(recordid)
+        if not values:
+            continue
+        groups.setdefault(tuple(sorted(values)), []).append(dict(values, _id=recordid))
+        changed_users.add(user_id)
+        if 'record_date' in values or 'calories' in values:
+            days = changed_days.setdefault(user_id, set())
+            days.update(date for date in (old_date, values.get('record_date')) if date is not None)
+
+    updated = 0
+    statement = record_update_statement()
+    for parameters in groups.values():
+        for parameters_chunk in chunked(parameters):
+            updated += db.session.execute(statement, parameters_chunk).rowcount
+    """ Totals are recomputed from the records, so a concurrent change of a record's date cannot skew them """
+    for user_id, days in changed_days.items():
+        for days_chunk in chunked(sorted(days)):
+            models.DailyTotal.rebuild(user_id=user_id, dates=days_chunk)
+    db.session.commit()
+    user_data_changed(*changed_users)
+
+    errors.sort(key=lambda error: error['index'])
+    return jsonify(wrap200code(updated=updated, errors=errors))
+
+
 """
 Data Schemas
 """
@@ -873,7 +1985,7 @@ registration_schema = {
 
 
 class RegistrationInputs(Inputs):
-    json = [JsonSchema(schema=registration_schema)]
+    json = [CompiledJsonSchema(schema=registration_schema)]
 
 
 new_record_schema = {
@@ -903,8 +2015,11 @@ new_record_schema = {
 }
 
 
+new_record_validator = CompiledJsonSchema(schema=new_record_schema)
+
+
 class NewRecordInputs(Inputs):
-    json = [JsonSchema(schema=new_record_schema)]
+    json = [new_record_validator]
 
 
 updated_record_schema = {
@@ -930,7 +2045,37 @@ updated_record_schema = {
 
 
 class UpdatedRecordInputs(Inputs):
-    json = [JsonSchema(schema=updated_record_schema)]
+    json = [CompiledJsonSchema(schema=updated_record_schema)]
+
+
+record_patch_schema = dict(updated_record_schema,
+                           title="A patch of a calories record",
+                           properties=dict(updated_record_schema['properties'],
+                                           id={"type": "integer", "minimum": 1}),
+                           required=["id"])
+
+
+record_patch_validator = CompiledJsonSchema(schema=record_patch_schema)
+
+
+delete_records_schema = {
+    "title": "Records to delete",
+    "type": "object",
+    "properties": {
+        "ids": {
+            "type": "array",
+            "items": {
+                "type": "integer",
+                "minimum": 1
+            }
+        },
+    },
+    "required": ["ids"]
+}
+
+
+class DeleteRecordsInputs(Inputs):
+    json = [CompiledJsonSchema(schema=delete_records_schema)]
 
 
 target_schema = {
@@ -948,7 +2093,7 @@ target_schema = {
 
 
 class TargetInputs(Inputs):
-    json = [JsonSchema(schema=target_schema)]
+    json = [CompiledJsonSchema(schema=target_schema)]
 
 
 roles_schema = {
@@ -964,4 +2109,4 @@ roles_schema = {
 
 
 class RoleInputs(Inputs):
-    json = [JsonSchema(schema=roles_schema)]
+    json = [CompiledJsonSchema(schema=roles_schema)]
@@ -0,0 +1,21 @@
+"""
+ASGI serving mode, for compatibility only
+
+Serves the app from an ASGI server such as uvicorn, for deployments that only run
+ASGI applications::
+
+    uvicorn eatme.asgi:application --workers 4
+
+The views and the database access stay synchronous: a2wsgi's ``WSGIMiddleware``
+runs the unchanged Flask app in a pool of ``ASGI_THREADS`` threads, so a request
+still holds a thread while it waits on the database. This is no faster than a
+threaded WSGI server; prefer one (e.g. gunicorn) where ASGI is not required.
+Keep ``ASGI_THREADS`` at most the database connection pool size plus its overflow,
+more threads would only queue for a connection.
+"""
+from a2wsgi import WSGIMiddleware
+
+from eatme import create_app
+
+app = create_app()
+application = WSGIMiddleware(app, workers=app.config['ASGI_THREADS'])
@@ -0,0 +1,234 @@
+"""
+Authentication token cache
+
+Verifying an authentication token means checking its signature and loading the
+user with its roles from the database. Verified tokens are kept in an in-process
+LRU cache with a time-to-live, so repeated requests with the same token skip both.
+
+The cache is per process, so on every hit the user's password fingerprint, active
+status and role names are read back with one small query and compared to the cached
+principal: a password, role or active status change made by any worker process
+takes effect on the next request. Entries are also dropped at once in the process
+making the change.
+
+Roles are only loaded together with the user (in one joined query) when
+authenticating, other user queries leave them to be loaded on access.
+"""
+import calendar
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask.ext.security import UserMixin
+from flask.ext.security.core import _security
+from flask.ext.security.utils import md5
+from sqlalchemy import bindparam, event, select
+from sqlalchemy.orm import joinedload
+from werkzeug.security import safe_str_cmp
+
+from . import db
+from .models import Role, User, roles_users
+
+CachedRole = namedtuple('CachedRole', ['name'])
+
+
+class CachedUser(UserMixin):
+    """
+    Lightweight stand-in for ``models.User`` restored from the token cache
+    """
+
+    def __init__(self, id, email, active, role_names, password_fingerprint):
+        self.id = id
+        self.email = email
+        self.active = active
+        self.role_names = frozenset(role_names)
+        self.roles = [CachedRole(name) for name in sorted(self.role_names)]
+        self.password_fingerprint = password_fingerprint
+
+    @classmethod
+    def from_user(cls, user, password_fingerprint):
+        return cls(user.id, user.email, user.active, [role.name for role in user.roles], password_fingerprint)
+
+    def has_role(self, role):
+        if not isinstance(role, str):
+            role = role.name
+        return role in self.role_names
+
+
+class TokenCache(object):
+    """
+    Thread-safe LRU cache of authentication tokens to ``CachedUser`` principals
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, token):
+        """
+        Return the cached principal for the token, or ``None``.
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                principal, expires = entry
+                if expires > time.time():
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return principal
+                self._remove(token)
+            self.misses += 1
+            return None
+
+    def set(self, token, principal, expires=None):
+        """
+        Cache a verified token, until ``expires`` (timestamp) if earlier than the TTL.
+        """
+        if not self.enabled:
+            return
+        deadline = time.time() + self.ttl
+        if expires is not None:
+            deadline = min(deadline, expires)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (principal, deadline)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """
+        Drop all cached tokens of a user.
+        """
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+    def _remove(self, token):
+        principal, _ = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(principal.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[principal.id]
+
+
+token_cache = TokenCache()
+
+# Password, active status and role names of a user, one row per role
+_credentials_query = select([User.password, User.active, Role.name]) \
+    .select_from(User.__table__
+                 .outerjoin(roles_users, roles_users.c.user_id == User.id)
+                 .outerjoin(Role.__table__, Role.id == roles_users.c.role_id)) \
+    .where(User.id == bindparam('user_id'))
+
+
+def load_user(user_id):
+    """
+    User loader for Flask-Login: the user with its roles, for the permission checks.
+    """
+    return User.query.options(joinedload(User.roles)).filter_by(id=user_id).first()
+
+
+def principal_is_current(principal):
+    """
+    Whether the password, active status and roles of a cached principal still match the database.
+    """
+    rows = db.session.execute(_credentials_query, {'user_id': principal.id}).fetchall()
+    if not rows:
+        return False
+    password, active, _ = rows[0]
+    return safe_str_cmp(md5(password), principal.password_fingerprint) and \
+        active == principal.active and \
+        frozenset(name for _, _, name in rows if name is not None) == principal.role_names
+
+
+def cached_token_loader(token):
+    """
+    Token loader for Flask-Login, consulting the cache before verifying the token
+    the same way as Flask-Security does.
+    """
+    if not token:
+        return _security.login_manager.anonymous_user()
+    principal = token_cache.get(token)
+    if principal is not None:
+        if principal_is_current(principal):
+            return principal
+        token_cache.invalidate_user(principal.id)
+    try:
+        data, timestamp = _security.remember_token_serializer.loads(token,
+                                                                   max_age=_security.token_max_age,
+                                                                   return_timestamp=True)
+        user = load_user(data[0])
+        if user and safe_str_cmp(md5(user.password), data[1]):
+            expires = None
+            if _security.token_max_age:
+                expires = calendar.timegm(timestamp.utctimetuple()) + _security.token_max_age
+            token_cache.set(token, CachedUser.from_user(user, data[1]), expires)
+            return user
+    except Exception:
+        pass
+    return _security.login_manager.anonymous_user()
+
+
+def init_token_cache(app, security):
+    """
+    Configure the token cache from the app config and install the user and token loaders.
+    """
+    security.login_manager.user_loader(load_user)
+    token_cache.max_size = app.config['AUTH_TOKEN_CACHE_SIZE']
+    token_cache.ttl = app.config['AUTH_TOKEN_CACHE_TTL']
+    if token_cache.enabled:
+        security.login_manager.token_loader(cached_token_loader)
+    return token_cache
+
+
+"""
+Invalidation when anything a cached principal depends on changes
+"""
+
+
+@event.listens_for(User.password, 'set')
+@event.listens_for(User.active, 'set')
+def _credentials_changed(target, value, oldvalue, initiator):
+    if target.id is not None and value != oldvalue:
+        token_cache.invalidate_user(target.id)
+
+
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _roles_changed(target, value, initiator):
+    if target.id is not None:
+        token_cache.invalidate_user(target.id)
@@ -0,0 +1,234 @@
+"""
+Per-user query result cache
+
+Serialized responses of per-user queries are cached under a key made of the
+endpoint, the user, the normalized query parameters and the user's data version.
+Every write to a user's data bumps the version after it is committed, so entries
+cached before the write can no longer be reached and simply age out.
+
+Two backends are available:
+
+* ``local``: an in-process LRU, bounded in entries and bytes. Versions live in the
+  process too, so a write handled by another worker process is not seen until the
+  entries expire after ``RESULT_CACHE_LOCAL_TTL`` seconds: keep that short, or use the
+  shared backend when running several worker processes.
+* ``shared``: a key-value store shared by all workers (Redis through ``redis-py`` if
+  ``RESULT_CACHE_REDIS_URL`` is set, otherwise the in-process ``LocalSharedStore``
+  stand-in with the same interface, e.g. for tests).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUBackend(object):
+    """
+    In-process LRU storage of byte strings, bounded in entries and total size, entries
+    expire after ``ttl`` seconds
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=5):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                self._bytes -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_version(self, user_id):
+        return self._versions.get(user_id, 0)
+
+    def bump_version(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'evictions': self.evictions}
+
+
+class LocalSharedStore(object):
+    """
+    In-process stand-in for the subset of the Redis client interface used by ``SharedBackend``
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (0, None))
+            value = int(value) + 1
+            self._data[key] = (value, expires)
+            return value
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(len(value) for value, _ in self._data.values() if isinstance(value, bytes))
+
+
+class SharedBackend(object):
+    """
+    Storage in a key-value store shared between processes, entries expire after ``ttl`` seconds
+    """
+
+    def __init__(self, client, ttl=300, prefix='eatme:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def get_version(self, user_id):
+        return int(self.client.get('{}version:{}'.format(self.prefix, user_id)) or 0)
+
+    def bump_version(self, user_id):
+        self.client.incr('{}version:{}'.format(self.prefix, user_id))
+
+    def clear(self):
+        self.client.flushdb()
+
+    def stats(self):
+        memory_usage = getattr(self.client, 'memory_usage', None)
+        return {'bytes': memory_usage() if memory_usage is not None else None,
+                'ttl': self.ttl}
+
+
+class ResultCache(object):
+    """
+    Versioned per-user cache of serialized query results
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def key(self, endpoint, user_id, params):
+        """
+        Cache key of a query, ``params`` being (name, value) pairs in any order.
+        """
+        normalized = '&'.join('{}={}'.format(name, value) for name, value in sorted(params))
+        digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+        return 'results:{}:{}:{}:{}'.format(endpoint, user_id, self.backend.get_version(user_id), digest)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def invalidate_user(self, user_id):
+        """
+        Make all cached results of a user unreachable. Call after the write is committed.
+        """
+        if self.enabled:
+            self.backend.bump_version(user_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {'enabled': self.enabled,
+                 'hits': self.hits,
+                 'misses': self.misses,
+                 'hit_ratio': float(self.hits) / lookups if lookups else 0.0}
+        if self.enabled:
+            stats['backend'] = type(self.backend).__name__
+            stats.update(self.backend.stats())
+        return stats
+
+
+result_cache = ResultCache()
+
+
+def init_result_cache(app):
+    """
+    Configure the result cache backend from the app config.
+    """
+    backend = app.config['RESULT_CACHE_BACKEND']
+    if backend == 'local':
+        result_cache.backend = LRUBackend(max_entries=app.config['RESULT_CACHE_MAX_ENTRIES'],
+                                          max_bytes=app.config['RESULT_CACHE_MAX_BYTES'],
+                                          ttl=app.config['RESULT_CACHE_LOCAL_TTL'])
+    elif backend == 'shared':
+        if app.config['RESULT_CACHE_REDIS_URL']:
+            import redis
+            client = redis.StrictRedis.from_url(app.config['RESULT_CACHE_REDIS_URL'])
+        else:
+            client = LocalSharedStore()
+        result_cache.backend = SharedBackend(client, ttl=app.config['RESULT_CACHE_TTL'])
+    elif backend is not None:
+        raise ValueError("Unknown RESULT_CACHE_BACKEND: {!r}".format(backend))
+    return result_cache
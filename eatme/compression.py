@@ -0,0 +1,59 @@
+"""
+Response compression
+
+Responses of compressible types above ``COMPRESS_MIN_SIZE`` bytes are compressed
+with brotli (when installed) or gzip, depending on the client's ``Accept-Encoding``.
+Streamed responses and files are left alone.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+def choose_encoding(accept_encodings):
+    """
+    Preferred supported content coding of the client, or ``None``.
+    """
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def init_compression(app):
+    """
+    Register the compression of responses on the app.
+    """
+    mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+                or 'Content-Encoding' in response.headers or response.mimetype not in mimetypes:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY']))
+        else:
+            response.set_data(gzip.compress(data, compresslevel=app.config['COMPRESS_LEVEL']))
+        response.headers['Content-Encoding'] = encoding
+        """ The compressed body is a different representation, only weakly equal to the original """
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return compress_response
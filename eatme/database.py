@@ -0,0 +1,183 @@
+"""
+Database engine setup
+
+Flask-SQLAlchemy creates the engines lazily. Each new engine gets the
+connection settings of the app config, which Flask-SQLAlchemy has no options for:
+
+* ``DATABASE_POOL_PRE_PING``: test pooled connections on checkout and replace the
+  ones the server has closed, instead of failing the request (not for SQLite).
+* ``SQLITE_JOURNAL_MODE``, ``SQLITE_SYNCHRONOUS`` and ``SQLITE_BUSY_TIMEOUT``:
+  pragmas set on every new SQLite connection. WAL lets readers and a writer work
+  concurrently, and a busy timeout makes writers wait for the lock instead of
+  failing with "database is locked".
+
+Views decorated with ``replica_reads`` read from the ``DATABASE_REPLICA_URI``
+database on GET requests. Right after a user's data is written, reads by that
+user and of that user's data stay on the primary database for
+``DATABASE_REPLICA_WINDOW`` seconds, while the replica catches up. The times of
+the last writes are kept in Redis at ``DATABASE_REPLICA_REDIS_URL`` if set, so
+every worker process sees them, and in the process otherwise (a single worker).
+"""
+import math
+import threading
+import time
+import weakref
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from flask.ext.security import current_user
+from flask_sqlalchemy import SignallingSession, SQLAlchemy as BaseSQLAlchemy, get_state
+from sqlalchemy import event, exc, select
+
+
+# Values per IN list, under the 999 bound parameters of older SQLite builds
+IN_LIST_MAX = 500
+
+
+def chunked(values, size=IN_LIST_MAX):
+    """
+    Consecutive lists of at most ``size`` of the values, e.g. for ``IN`` lists.
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """
+    Flask-SQLAlchemy applying the connection settings of the app config to its engines
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._configured_engines = weakref.WeakSet()
+        self._configure_lock = threading.Lock()
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def get_engine(self, app, bind=None):
+        engine = super(SQLAlchemy, self).get_engine(app, bind)
+        if engine not in self._configured_engines:
+            with self._configure_lock:
+                if engine not in self._configured_engines:
+                    configure_engine(engine, app.config)
+                    self._configured_engines.add(engine)
+        return engine
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session reading from the ``replica`` bind while ``g.use_replica`` is set, writing to the primary
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context() and g.get('use_replica') and not self._flushing \
+                and not (self.new or self.dirty or self.deleted):
+            return get_state(self.app).db.get_engine(self.app, bind='replica')
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RecentWrites(object):
+    """
+    Users whose data was written in the last ``window`` seconds, in a store shared by
+    the worker processes (a Redis ``client``) or in this process
+    """
+
+    def __init__(self, window=5, client=None, prefix='eatme:written:'):
+        self.window = window
+        self.client = client
+        self.prefix = prefix
+        self._written = {}
+        self._lock = threading.Lock()
+
+    def add(self, *user_ids):
+        now = time.time()
+        if self.client is not None:
+            for user_id in user_ids:
+                self.client.set(self.prefix + str(user_id), str(now), ex=int(math.ceil(self.window)))
+            return
+        with self._lock:
+            for user_id in user_ids:
+                self._written[user_id] = now
+            if len(self._written) > 10000:
+                self._written = {user_id: written for user_id, written in self._written.items()
+                                 if written > now - self.window}
+
+    def __contains__(self, user_id):
+        if self.client is not None:
+            written = self.client.get(self.prefix + str(user_id))
+            return written is not None and float(written) > time.time() - self.window
+        written = self._written.get(user_id)
+        return written is not None and written > time.time() - self.window
+
+
+recent_writes = RecentWrites()
+
+
+def init_recent_writes(app):
+    """
+    Configure the window and the store of the recent writes from the app config.
+    """
+    recent_writes.window = app.config['DATABASE_REPLICA_WINDOW']
+    recent_writes.client = None
+    if app.config['DATABASE_REPLICA_REDIS_URL']:
+        import redis
+        recent_writes.client = redis.StrictRedis.from_url(app.config['DATABASE_REPLICA_REDIS_URL'])
+    return recent_writes
+
+
+def replica_reads(view):
+    """
+    Read from the replica in a GET view, unless the current user or the ``userid``
+    of the view wrote recently.
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and current_app.config['DATABASE_REPLICA_URI']:
+            user_ids = (current_user.id, kwargs.get('userid'))
+            if not any(user_id in recent_writes for user_id in user_ids if user_id is not None):
+                g.use_replica = True
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+def configure_engine(engine, config):
+    """
+    Register the connection settings of ``config`` on a new engine.
+    """
+    if engine.dialect.name == 'sqlite':
+        in_memory = engine.url.database in (None, '', ':memory:')
+        journal_mode = None if in_memory else config['SQLITE_JOURNAL_MODE']
+        pragmas = [('journal_mode', journal_mode),
+                   ('synchronous', config['SQLITE_SYNCHRONOUS']),
+                   ('busy_timeout', config['SQLITE_BUSY_TIMEOUT'])]
+        pragmas = ['PRAGMA {}={}'.format(name, value) for name, value in pragmas if value is not None]
+        if pragmas:
+            @event.listens_for(engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+                cursor.close()
+    elif config['DATABASE_POOL_PRE_PING']:
+        event.listen(engine, 'engine_connect', ping_connection)
+
+
+def ping_connection(connection, branch):
+    """
+    Pessimistic disconnect handling: a failing ping on a connection the server has
+    closed invalidates the whole pool, and the ping is retried on a new connection.
+    """
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as error:
+        if not error.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
@@ -0,0 +1,260 @@
+"""
+Request instrumentation
+
+Records per endpoint the wall time of requests, the number and total time of
+their SQL statements (including their compilation), and the time spent in
+authentication and in serialization.
+Requests ending in an unhandled exception (500) are recorded too, and counted
+separately. The histograms are served in the Prometheus text format on ``/metrics``,
+to administrators only unless ``METRICS_PUBLIC`` is set (a Prometheus scrape job can
+pass an administrator's ``auth_token`` in its ``params``). The timings of each
+request can be sent in a ``Server-Timing`` header (``METRICS_SERVER_TIMING``),
+where browser developer tools show them.
+
+Requests running more than ``METRICS_QUERY_WARNING`` SQL statements are logged,
+so that N+1 query regressions show up right away.
+
+The histograms are kept per process.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, g, has_app_context, request
+from flask.ext.security import auth_required, current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram(object):
+    """
+    Prometheus histogram with an ``endpoint`` label
+    """
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((endpoint, list(counts), total) for endpoint, (counts, total) in self._series.items())
+        for endpoint, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(self.name, endpoint, bound, cumulative))
+            lines.append('{}_sum{{endpoint="{}"}} {!r}'.format(self.name, endpoint, total))
+            lines.append('{}_count{{endpoint="{}"}} {}'.format(self.name, endpoint, cumulative))
+        return '\n'.join(lines)
+
+
+class Counter(object):
+    """
+    Prometheus counter with an ``endpoint`` label
+    """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, endpoint):
+        with self._lock:
+            self._series[endpoint] = self._series.get(endpoint, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            series = sorted(self._series.items())
+        for endpoint, count in series:
+            lines.append('{}{{endpoint="{}"}} {}'.format(self.name, endpoint, count))
+        return '\n'.join(lines)
+
+
+request_duration = Histogram('eatme_request_duration_seconds', "Wall time of requests.", DURATION_BUCKETS)
+request_queries = Histogram('eatme_request_queries', "SQL statements run by requests.", COUNT_BUCKETS)
+query_duration = Histogram('eatme_request_query_duration_seconds', "Time of the SQL statements of requests.",
+                           DURATION_BUCKETS)
+auth_duration = Histogram('eatme_request_auth_duration_seconds', "Time spent authenticating requests.",
+                          DURATION_BUCKETS)
+serialization_duration = Histogram('eatme_request_serialization_duration_seconds',
+                                   "Time spent serializing responses.", DURATION_BUCKETS)
+
+request_errors = Counter('eatme_request_errors_total', "Requests ending in an unhandled exception (500).")
+
+collectors = [request_duration, request_queries, query_duration, auth_duration, serialization_duration,
+              request_errors]
+
+
+class RequestTimings(object):
+    """
+    Timings of the current request, kept in ``g.request_timings``
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.auth_time = 0.0
+        self.serialization_time = 0.0
+
+
+def current_timings():
+    if has_app_context():
+        return g.get('request_timings')
+    return None
+
+
+@contextmanager
+def timed(part):
+    """
+    Add the time spent in the block to the ``part`` ('auth' or 'serialization') of the request's timings.
+    """
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        attribute = part + '_time'
+        setattr(timings, attribute, getattr(timings, attribute) + time.perf_counter() - start)
+
+
+def timed_function(part, function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with timed(part):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def _before_execute(conn, clauseelement, multiparams, params):
+    if current_timings() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_execute(conn, clauseelement, multiparams, params, result):
+    timings = current_timings()
+    starts = conn.info.get('query_start')
+    if timings is not None and starts:
+        timings.queries += 1
+        timings.query_time += time.perf_counter() - starts.pop()
+
+
+def _handle_error(context):
+    """ A failed statement gets no ``after_execute``, take its start off the stack """
+    connection = context.connection
+    starts = connection.info.get('query_start') if connection is not None else None
+    if starts:
+        start = starts.pop()
+        timings = current_timings()
+        if timings is not None:
+            timings.queries += 1
+            timings.query_time += time.perf_counter() - start
+
+
+def render_metrics():
+    return '\n'.join(collector.render() for collector in collectors) + '\n'
+
+
+def init_metrics(app, security_state):
+    """
+    Instrument the requests of the app and serve the metrics on ``/metrics``.
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    if not event.contains(Engine, 'before_execute', _before_execute):
+        event.listen(Engine, 'before_execute', _before_execute)
+        event.listen(Engine, 'after_execute', _after_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    login_manager = security_state.login_manager
+    for name in ('user_callback', 'token_callback', 'request_callback', 'header_callback'):
+        callback = getattr(login_manager, name, None)
+        if callback is not None:
+            setattr(login_manager, name, timed_function('auth', callback))
+
+    @app.before_request
+    def start_request_timings():
+        g.request_timings = RequestTimings()
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = g.get('request_timings')
+        if timings is not None and app.config['METRICS_SERVER_TIMING']:
+            response.headers['Server-Timing'] = ', '.join([
+                'db;dur={:.2f};desc="{} queries"'.format(1000 * timings.query_time, timings.queries),
+                'auth;dur={:.2f}'.format(1000 * timings.auth_time),
+                'serialization;dur={:.2f}'.format(1000 * timings.serialization_time),
+                'total;dur={:.2f}'.format(1000 * (time.perf_counter() - timings.start))])
+        return response
+
+    @app.teardown_request
+    def record_request_timings(exc):
+        """ Runs after every request, also those ending in an unhandled exception """
+        timings = g.get('request_timings')
+        if timings is None:
+            return
+        elapsed = time.perf_counter() - timings.start
+        endpoint = request.endpoint or 'unknown'
+        request_duration.observe(endpoint, elapsed)
+        request_queries.observe(endpoint, timings.queries)
+        query_duration.observe(endpoint, timings.query_time)
+        auth_duration.observe(endpoint, timings.auth_time)
+        serialization_duration.observe(endpoint, timings.serialization_time)
+        if exc is not None:
+            request_errors.inc(endpoint)
+
+        if timings.queries > app.config['METRICS_QUERY_WARNING']:
+            app.logger.warning("%s %s ran %d SQL statements", request.method, request.path, timings.queries)
+
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    if not app.config['METRICS_PUBLIC']:
+        metrics = admin_only(metrics)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def admin_only(view):
+    """
+    Restrict a plain text view to authenticated administrators.
+    """
+    @auth_required('token', 'session')
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        if not current_user.has_role('admin'):
+            return Response("Only administrators have access to the metrics.\n", status=403, mimetype='text/plain')
+        return view(*args, **kwargs)
+    return decorated_view
@@ -1,7 +1,11 @@
+from datetime import timezone
+
 from flask import g
 from flask.ext.security import Security, SQLAlchemyUserDatastore, \
     UserMixin, RoleMixin
+from sqlalchemy.exc import IntegrityError
 from . import db, ma
+from .metrics import timed
 
 
 # Define a base model for other database tables to inherit
@@ -46,11 +50,45 @@ class User(Base, UserMixin):
                             backref=db.backref('users', lazy='dynamic'))
     records = db.relationship('Record', backref='users', lazy='dynamic')
 
+    @property
+    def role_names(self):
+        """
+        Names of the user's roles, computed once per loaded instance
+        """
+        names = self.__dict__.get('_role_names')
+        if names is None:
+            names = self._role_names = frozenset(role.name for role in self.roles)
+        return names
+
+    def has_role(self, role):
+        if not isinstance(role, str):
+            role = role.name
+        return role in self.role_names
+
+
+@db.event.listens_for(User.roles, 'append')
+@db.event.listens_for(User.roles, 'remove')
+def _reset_role_names(target, value, initiator):
+    target.__dict__.pop('_role_names', None)
+
+
+@db.event.listens_for(User, 'expire')
+@db.event.listens_for(User, 'refresh')
+def _expire_role_names(target, *args):
+    target.__dict__.pop('_role_names', None)
+
 
 class Record(Base):
     """
     Calories records
     """
+    __table_args__ = (
+        # Per-user listing and date/time filtering
+        db.Index('ix_record_user_date_time', 'user_id', 'record_date', 'record_time'),
+        # Covers daily calories aggregation without touching the table rows
+        db.Index('ix_record_user_date_calories', 'user_id', 'record_date', 'calories'),
+    )
+
     record_date = db.Column(db.Date())
     record_time = db.Column(db.Time())
     description = db.Column(db.Unicode(255))
@@ -58,6 +96,93 @@ class Record(Base):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
 
+class DailyTotal(Base):
+    """
+    Per-user daily calories totals, maintained along with the records
+    """
+    __table_args__ = (db.UniqueConstraint('user_id', 'record_date'),)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    record_date = db.Column(db.Date(), nullable=False)
+    calories_sum = db.Column(db.Integer, nullable=False, default=0)
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def adjust(cls, user_id, record_date, calories, count):
+        """
+        Add ``calories`` and ``count`` to a user's total for a given day, in the current
+        transaction. Days that no longer have any records are removed.
+
+        Concurrent first writes of the same day do not fail on the unique constraint:
+        MySQL upserts the row in one statement, on other databases the insert is tried
+        in a savepoint and the update is repeated if another transaction inserted the day first.
+        """
+        if db.session.get_bind(mapper=cls.__mapper__).dialect.name == 'mysql':
+            db.session.execute(
+                db.text('INSERT INTO {} (user_id, record_date, calories_sum, record_count, '
+                        'date_created, date_modified) '
+                        'VALUES (:user_id, :record_date, :calories, :count, now(), now()) '
+                        'ON DUPLICATE KEY UPDATE calories_sum = calories_sum + VALUES(calories_sum), '
+                        'record_count = record_count + VALUES(record_count), '
+                        'date_modified = now()'.format(cls.__tablename__)),
+                {'user_id': user_id, 'record_date': record_date, 'calories': calories, 'count': count})
+        elif not cls._add_to_existing(user_id, record_date, calories, count):
+            try:
+                with db.session.begin_nested():
+                    db.session.add(cls(user_id=user_id,
+                                       record_date=record_date,
+                                       calories_sum=calories,
+                                       record_count=count))
+            except IntegrityError:
+                cls._add_to_existing(user_id, record_date, calories, count)
+        if count < 0:
+            cls.query.filter_by(user_id=user_id, record_date=record_date) \
+                .filter(cls.record_count <= 0) \
+                .delete(synchronize_session=False)
+
+    @classmethod
+    def _add_to_existing(cls, user_id, record_date, calories, count):
+        """ Update an existing daily total, returns the number of rows updated """
+        return cls.query.filter_by(user_id=user_id, record_date=record_date) \
+            .update({cls.calories_sum: cls.calories_sum + calories,
+                     cls.record_count: cls.record_count + count},
+                    synchronize_session=False)
+
+    @classmethod
+    def rebuild(cls, user_id=None, date_start=None, date_end=None, dates=None, user_ids=None):
+        """
+        Recreate the daily totals from the records table: all of them, or only those of
+        ``user_id`` (or the users in ``user_ids``) between ``date_start`` and ``date_end``
+        (inclusive) or on ``dates`` if given.
+        """
+        totals_filters = []
+        records_filters = [Record.record_date.isnot(None)]
+        if user_id is not None:
+            totals_filters.append(cls.user_id == user_id)
+            records_filters.append(Record.user_id == user_id)
+        if user_ids is not None:
+            totals_filters.append(cls.user_id.in_(user_ids))
+            records_filters.append(Record.user_id.in_(user_ids))
+        if date_start is not None:
+            totals_filters.append(cls.record_date >= date_start)
+            records_filters.append(Record.record_date >= date_start)
+        if date_end is not None:
+            totals_filters.append(cls.record_date <= date_end)
+            records_filters.append(Record.record_date <= date_end)
+        if dates is not None:
+            totals_filters.append(cls.record_date.in_(dates))
+            records_filters.append(Record.record_date.in_(dates))
+        cls.query.filter(*totals_filters).delete(synchronize_session=False)
+        totals = db.select([Record.user_id,
+                            Record.record_date,
+                            db.func.sum(Record.calories),
+                            db.func.count(Record.id)]) \
+            .where(db.and_(*records_filters)) \
+            .group_by(Record.user_id, Record.record_date)
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'record_date', 'calories_sum', 'record_count'], totals))
+
+
 """
 Output Schemas
 """
@@ -74,7 +199,9 @@ class UserSchema(ma.Schema):
         'collection': ma.URLFor('api.users'),
         'roles': ma.URLFor('api.users_roles', userid='<id>'),
         'targets': ma.URLFor('api.users_targets', userid='<id>'),
-        'records': ma.URLFor('api.users_records', userid='<id>')
+        'records': ma.URLFor('api.users_records', userid='<id>'),
+        'daily': ma.URLFor('api.users_daily', userid='<id>'),
+        'statistics': ma.URLFor('api.users_statistics', userid='<id>')
     })
 
 
@@ -99,6 +226,47 @@ record_schema = RecordSchema()
 records_schema = RecordSchema(many=True)
 
 
+def _isoformat_datetime(value):
+    """ Same output as marshmallow's DateTime field: ISO 8601 in UTC """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.isoformat() + '+00:00'
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def _isoformat_time(value):
+    """ Same output as marshmallow's Time field: microseconds truncated to milliseconds """
+    if value is None:
+        return None
+    if value.microsecond:
+        return value.isoformat()[:12]
+    return value.isoformat()
+
+
+def record_to_dict(record):
+    """
+    Serialize a record to the same dictionary as ``record_schema``, without marshmallow's
+    per-field overhead.
+    """
+    return {'id': record.id,
+            'date_created': _isoformat_datetime(record.date_created),
+            'date_modified': _isoformat_datetime(record.date_modified),
+            'record_date': record.record_date.isoformat() if record.record_date is not None else None,
+            'record_time': _isoformat_time(record.record_time),
+            'description': record.description,
+            'calories': record.calories,
+            'user_id': record.user_id}
+
+
+def dump_records(records):
+    """
+    Serialize many records, equivalent to ``records_schema.dump(records).data``.
+    """
+    with timed('serialization'):
+        return [record_to_dict(record) for record in records]
+
+
 class TargetSchema(ma.Schema):
     class Meta:
         # Fields to expose
@@ -0,0 +1,43 @@
+"""
+Date and time parsing of API inputs
+
+``datetime.strptime`` takes a lock and goes through a regular expression for every
+call. The formats accepted by the API are fixed width in practice, so those are
+parsed by slicing, and anything else falls back to ``strptime`` with the same
+formats as before. Invalid values raise ``ValueError`` either way.
+"""
+from datetime import date, datetime, time
+
+_ASCII_DIGITS = frozenset('0123456789')
+
+
+def _digits(value, start, end):
+    part = value[start:end]
+    if not _ASCII_DIGITS.issuperset(part):
+        raise ValueError("Invalid number: {!r}".format(part))
+    return int(part)
+
+
+def parse_date(value):
+    """
+    Parse a 'YYYY-MM-DD' date.
+    """
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date(_digits(value, 0, 4), _digits(value, 5, 7), _digits(value, 8, 10))
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_time(value):
+    """
+    Parse a 'HH:MM' or 'HH:MM:SS' time (24H).
+    """
+    if len(value) == 5 and value[2] == ':':
+        return time(_digits(value, 0, 2), _digits(value, 3, 5))
+    if len(value) == 8 and value[2] == ':' and value[5] == ':':
+        return time(_digits(value, 0, 2), _digits(value, 3, 5), _digits(value, 6, 8))
+    if len(value) > 5:
+        """ Use full time format: 12:30:45 """
+        return datetime.strptime(value, '%H:%M:%S').time()
+    else:
+        """ Use hour/minute time format: 12:30 """
+        return datetime.strptime(value, '%H:%M').time()
@@ -0,0 +1,205 @@
+"""
+Password hashing off the request thread
+
+bcrypt is deliberately slow and holds the GIL, so hashing on the request thread
+stalls every other request served by the same process. Hashes are computed and
+verified in a bounded process pool instead. When more than ``PASSWORD_HASH_QUEUE_MAX``
+operations are pending the request is rejected with a 503, rather than letting
+logins queue up behind each other until they time out. A hashing process that does
+not answer within ``PASSWORD_HASH_TIMEOUT`` seconds, or dies, gets the same 503;
+a dead pool is replaced on the next operation.
+
+The bcrypt cost is ``PASSWORD_HASH_ROUNDS``. Hashes made with a different cost
+still verify, and are transparently rehashed with the configured cost on login.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from flask.ext.security.confirmable import requires_confirmation
+from flask.ext.security.core import _security
+from flask.ext.security.forms import LoginForm as SecurityLoginForm
+from flask.ext.security.utils import get_hmac, get_message
+from passlib.context import CryptContext
+
+from .serialization import jsonify
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when too many password operations are already pending, or the pool failed to answer
+    """
+
+
+"""
+Work done in the pool processes, with the hashing policy passed as a string
+"""
+
+
+@lru_cache(maxsize=8)
+def _context(policy):
+    return CryptContext.from_string(policy)
+
+
+def _encrypt(policy, signed_password):
+    return _context(policy).encrypt(signed_password)
+
+
+def _verify_and_update(policy, signed_password, password_hash):
+    return _context(policy).verify_and_update(signed_password, password_hash)
+
+
+class PasswordHasher(object):
+    """
+    Runs password hashing in a process pool of ``workers`` processes, in the calling
+    thread if ``workers`` is 0
+    """
+
+    def __init__(self, workers=2, queue_max=32, timeout=30):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self.policy = None
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.rehashed = 0
+
+    def configure(self, pwd_context, rounds):
+        """
+        Use the hashing schemes of ``pwd_context`` with a bcrypt cost of ``rounds``.
+        """
+        pwd_context.update(bcrypt__default_rounds=rounds,
+                           bcrypt__min_rounds=rounds,
+                           bcrypt__max_rounds=rounds)
+        self.policy = pwd_context.to_string()
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.queue_max:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            self._pending += 1
+            if self.workers and self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            executor = self._executor
+        try:
+            if executor is None:
+                result = fn(self.policy, *args)
+            else:
+                future = executor.submit(fn, self.policy, *args)
+                try:
+                    result = future.result(timeout=self.timeout)
+                except TimeoutError:
+                    future.cancel()
+                    self.failed += 1
+                    raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            """ A hashing process died: the pool has terminated its other processes and cannot be
+            used anymore (its queues may be locked, so it is not shut down), start a new one next time """
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            self.failed += 1
+            raise PasswordHasherBusy()
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self.completed += 1
+        return result
+
+    def encrypt(self, password):
+        """
+        Hash a plaintext password the way ``flask_security.utils.encrypt_password`` does.
+        """
+        return self._run(_encrypt, get_hmac(password).decode('ascii'))
+
+    def verify_and_update(self, password, user):
+        """
+        Check a plaintext password against the user's hash, and replace the hash if it
+        was made with outdated settings. The user is not committed.
+        """
+        verified, new_hash = self._run(_verify_and_update, get_hmac(password).decode('ascii'), user.password)
+        if verified and new_hash:
+            user.password = new_hash
+            _security.datastore.put(user)
+            self.rehashed += 1
+        return verified
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers,
+                    'queue_max': self.queue_max,
+                    'pending': self._pending,
+                    'completed': self.completed,
+                    'rejected': self.rejected,
+                    'failed': self.failed,
+                    'rehashed': self.rehashed}
+
+
+password_hasher = PasswordHasher()
+
+
+class LoginForm(SecurityLoginForm):
+    """
+    Flask-Security login form verifying the password through ``password_hasher``
+    """
+
+    def validate(self):
+        if not super(SecurityLoginForm, self).validate():
+            return False
+
+        if self.email.data.strip() == '':
+            self.email.errors.append(get_message('EMAIL_NOT_PROVIDED')[0])
+            return False
+        if self.password.data.strip() == '':
+            self.password.errors.append(get_message('PASSWORD_NOT_PROVIDED')[0])
+            return False
+
+        self.user = _security.datastore.get_user(self.email.data)
+        if self.user is None:
+            self.email.errors.append(get_message('USER_DOES_NOT_EXIST')[0])
+            return False
+        if not self.user.password:
+            self.password.errors.append(get_message('PASSWORD_NOT_SET')[0])
+            return False
+        if not password_hasher.verify_and_update(self.password.data, self.user):
+            self.password.errors.append(get_message('INVALID_PASSWORD')[0])
+            return False
+        if requires_confirmation(self.user):
+            self.email.errors.append(get_message('CONFIRMATION_REQUIRED')[0])
+            return False
+        if not self.user.is_active:
+            self.email.errors.append(get_message('DISABLED_ACCOUNT')[0])
+            return False
+        return True
+
+
+def init_password_hasher(app, security):
+    """
+    Configure the password hasher from the app config and answer with a 503 when it is busy.
+    """
+    password_hasher.workers = app.config['PASSWORD_HASH_WORKERS']
+    password_hasher.queue_max = app.config['PASSWORD_HASH_QUEUE_MAX']
+    password_hasher.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+    password_hasher.configure(security.pwd_context, app.config['PASSWORD_HASH_ROUNDS'])
+
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(error):
+        response = jsonify({'meta': {'code': 503},
+                            'response': {'error': {'message': "Server busy, try again later."}}})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+    return password_hasher
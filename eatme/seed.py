@@ -0,0 +1,122 @@
+"""
+Synthetic data for scale testing
+
+Generates users with roles and their calories records, with histories of up to
+a few years ending today. Records cluster around mealtimes, with calories and
+descriptions depending on the meal, and users skip logging some days.
+
+Rows are generated in Python and written with chunked core ``INSERT``
+statements, committing each chunk, so the ORM and bcrypt are skipped: all users
+get the same precomputed password hash. The daily totals of the new users are
+built at the end.
+"""
+import random
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+
+from . import db, models, user_datastore
+from .database import chunked
+
+# Name, time of the day (minutes), spread (minutes), share of the records, mean calories, descriptions
+MEALS = (
+    ('breakfast', 7 * 60 + 30, 45, 0.27, 400, ('Oatmeal', 'Toast and eggs', 'Yogurt with fruit', 'Cereal')),
+    ('lunch', 12 * 60 + 30, 40, 0.30, 650, ('Sandwich', 'Salad', 'Pasta', 'Soup and bread', 'Burrito')),
+    ('snack', 16 * 60, 75, 0.13, 200, ('Apple', 'Chocolate bar', 'Nuts', 'Coffee and cookie')),
+    ('dinner', 19 * 60, 50, 0.30, 750, ('Steak and potatoes', 'Pizza', 'Curry and rice', 'Fish and vegetables')),
+)
+
+TARGETS = (0, 0, 0, 1500, 1800, 2000, 2000, 2200, 2500, 3000)
+
+
+def generate_records(rng, user_id, n_records, first_day, last_day, skip_share=0.2):
+    """
+    Records of a user between two dates (ordinals), as dictionaries for a core insert.
+    """
+    days = [day for day in range(first_day, last_day + 1) if rng.random() >= skip_share] or [last_day]
+    cumulative = [sum(meal[3] for meal in MEALS[:i + 1]) for i in range(len(MEALS))]
+    for _ in range(n_records):
+        _, minute, spread, _, calories, descriptions = MEALS[bisect_left(cumulative, rng.random() * cumulative[-1])]
+        minute = min(max(int(rng.gauss(minute, spread)), 0), 24 * 60 - 1)
+        when = datetime.fromordinal(rng.choice(days)) + timedelta(minutes=minute, seconds=rng.randrange(60))
+        logged = when + timedelta(minutes=rng.randrange(120))
+        yield {'user_id': user_id,
+               'record_date': when.date(),
+               'record_time': when.time(),
+               'description': rng.choice(descriptions),
+               'calories': max(10, int(rng.gauss(calories, calories * 0.3))),
+               'date_created': logged,
+               'date_modified': logged}
+
+
+def insert_chunks(table, rows, chunk_size, progress=None):
+    """
+    Insert rows from an iterable with one ``INSERT`` (executemany) and commit per chunk.
+    """
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            db.session.execute(table.insert(), chunk)
+            db.session.commit()
+            total += len(chunk)
+            chunk = []
+            if progress is not None:
+                progress(total)
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        total += len(chunk)
+        if progress is not None:
+            progress(total)
+    return total
+
+
+def seed(n_users, records_per_user, password_hash, years=3, editor_share=0.05, admin_share=0.01,
+         email_prefix='seed', chunk_size=10000, random_seed=None, progress=None):
+    """
+    Add ``n_users`` users with ``records_per_user`` records each on average, in an app
+    context. Returns the ids of the new users.
+    """
+    rng = random.Random(random_seed)
+    today = date.today()
+    last_id = db.session.query(db.func.max(models.User.id)).scalar() or 0
+    first_index = db.session.query(models.User.id).filter(
+        models.User.email.like('{}%@example.com'.format(email_prefix))).count()
+
+    starts = [today - timedelta(days=rng.randint(30, int(years * 365))) for _ in range(n_users)]
+    insert_chunks(models.User.__table__,
+                  ({'email': '{}{}@example.com'.format(email_prefix, first_index + i),
+                    'password': password_hash,
+                    'active': True,
+                    'target_daily_calories': rng.choice(TARGETS),
+                    'date_created': datetime.combine(start, datetime.min.time()),
+                    'date_modified': datetime.combine(start, datetime.min.time())}
+                   for i, start in enumerate(starts)),
+                  chunk_size)
+    user_ids = [user_id for user_id, in db.session.query(models.User.id)
+                .filter(models.User.id > last_id).order_by(models.User.id)]
+
+    roles = {}
+    for name, description in (('admin', 'Administrator'), ('editor', 'Editor')):
+        roles[name] = user_datastore.find_role(name) or user_datastore.create_role(name=name,
+                                                                                    description=description)
+    db.session.commit()
+    admins = rng.sample(user_ids, int(admin_share * len(user_ids)))
+    editors = set(admins) | set(rng.sample(user_ids, int(editor_share * len(user_ids))))
+    insert_chunks(models.roles_users,
+                  [{'user_id': user_id, 'role_id': roles['admin'].id} for user_id in admins] +
+                  [{'user_id': user_id, 'role_id': roles['editor'].id} for user_id in editors],
+                  chunk_size)
+
+    def records():
+        for user_id, start in zip(user_ids, starts):
+            n_records = max(0, int(rng.gauss(records_per_user, records_per_user * 0.5)))
+            yield from generate_records(rng, user_id, n_records, start.toordinal(), today.toordinal())
+
+    insert_chunks(models.Record.__table__, records(), chunk_size, progress)
+    """ Daily totals of the new users only, a few hundred users per statement """
+    for user_ids_chunk in chunked(user_ids):
+        models.DailyTotal.rebuild(user_ids=user_ids_chunk)
+        db.session.commit()
+    return user_ids
@@ -0,0 +1,53 @@
+"""
+JSON response serialization
+
+Uses ``orjson`` when it is installed, and the standard library through Flask's
+encoder otherwise. Output is compact unless ``JSONIFY_PRETTYPRINT_REGULAR`` is set.
+"""
+from flask import current_app, json, request
+
+from .metrics import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _backend():
+    backend = current_app.config['JSON_BACKEND']
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'stdlib'
+    if backend == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_BACKEND is 'orjson' but orjson is not installed")
+    return backend
+
+
+def dumps(obj, pretty=False):
+    """
+    Serialize ``obj`` to JSON, returned as UTF-8 encoded bytes.
+    """
+    with timed('serialization'):
+        return _dumps(obj, pretty)
+
+
+def _dumps(obj, pretty):
+    if _backend() == 'orjson':
+        option = orjson.OPT_NON_STR_KEYS
+        if current_app.config['JSON_SORT_KEYS']:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def jsonify(*args, **kwargs):
+    """
+    Replacement of ``flask.jsonify`` using the configured JSON backend.
+    """
+    pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr
+    return current_app.response_class(dumps(dict(*args, **kwargs), pretty=pretty),
+                                      mimetype='application/json')
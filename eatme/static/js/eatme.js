@@ -9,6 +9,9 @@ $(document).ready(function() {
         showmessage('');
     }
 
+    // Number of most recent records shown on the dashboard
+    var recordsPageSize = 100;
+
     var authButtons = function() {
         clearmessage();
         if (localStorage.getItem('auth_token')) {
@@ -58,65 +61,75 @@ $(document).ready(function() {
         });
     };
 
-    var getMyCalories = function() {
+    // Colour each day's rows by the server side daily totals, from the oldest day shown.
+    var markDailyTargets = function(me, dateStart) {
+        $.ajax({
+            url: me._links.daily,
+            type: 'GET',
+            data: dateStart ? {date_start: dateStart} : {},
+            success: function(data, textStatus, xhr) {
+                if (data.meta.code === 200) {
+                    var daily = data.response.daily;
+                    for (var i = 0; i < daily.length; i++) {
+                        var rows = $(".records-"+daily[i].record_date);
+                        if (daily[i].over_target) {
+                            rows.addClass('overTarget');
+                            rows.removeClass('withinTarget');
+                        } else {
+                            rows.removeClass('overTarget');
+                            rows.addClass('withinTarget');
+                        }
+                    }
+                }
+            },
+            error: function(data){
+                console.log('Error!');
+                console.log(data);
+            }
+        });
+    };
+
+    // Link to the next page of records, and the oldest record date shown so far
+    var nextRecordsUrl = null;
+    var oldestRecordDate = null;
+
+    // Show the first page of records, or append the next page if `more` is set
+    var getMyCalories = function(more) {
         $("#caloriesContainer").show();
         clearmessage();
         var me = JSON.parse(localStorage.getItem('user'));
         console.log(me);
         $.ajax({
-            url: me._links.records,
+            url: more ? nextRecordsUrl : me._links.records,
             type: 'GET',
+            data: more ? {} : {limit: recordsPageSize},
             success: function(data, textStatus, xhr) {
                 if (data.meta.code === 200) {
                     console.log(data.response);
                     var tbody = $("#caloryData");
-                    tbody.html('');
+                    if (!more) {
+                        tbody.html('');
+                        oldestRecordDate = null;
+                    }
                     records = data.response.records;
                     var showdata = '';
-                    var todaydate = '';
-                    var lastdate = '';
-                    var todaysum = 0;
-                    var above = [];
-                    var below = [];
                     for(var i = 0; i < records.length; i++) {
-                        console.log(todaydate);
-                        if (todaydate !== records[i].record_date) {
-                            if (todaydate.length > 0) {
-                                if (todaysum > me.target_daily_calories) {
-                                    above.push(".records-"+todaydate);
-                                } else {
-                                    below.push(".records-"+todaydate);
-                                }
-                            }
-                            todaydate = records[i].record_date;
-                            todaysum = 0;
-                        }
                         showdata += '<tr class="records-'+records[i].record_date+'">';
                         showdata += '<td>'+records[i].record_date+'</td>';
                         showdata += '<td>'+records[i].record_time+'</td>';
                         showdata += '<td>'+records[i].description+'</td>';
                         showdata += '<td>'+records[i].calories+'</td>';
                         showdata += '<td>Edit</td>';
-                        showdata += '<tr>';
-
-                        todaysum += records[i].calories;
-                        console.log(todaysum);
-                    }
-                    if (todaysum > me.target_daily_calories) {
-                        above.push(".records-"+todaydate);
-                    } else {
-                        below.push(".records-"+todaydate);
+                        showdata += '</tr>';
                     }
                     tbody.append(showdata);
-                    for (var i = 0; i < above.length; i++) {
-                        $(above[i]).addClass('overTarget');
-                        $(above[i]).removeClass('withinTarget');
-                    }
-                    for (var i = 0; i < below.length; i++) {
-                        $(below[i]).removeClass('overTarget');
-                        $(below[i]).addClass('withinTarget');
+                    // Records are listed newest first
+                    if (records.length > 0) {
+                        oldestRecordDate = records[records.length - 1].record_date;
                     }
-
+                    nextRecordsUrl = data.response._links.next || null;
+                    $("#more-records-button").toggle(nextRecordsUrl !== null);
+                    markDailyTargets(me, oldestRecordDate);
                 }
             },
             error: function(data){
@@ -149,6 +162,10 @@ $(document).ready(function() {
         getMyCalories();
     });
 
+    $("button#more-records-button").click(function() {
+        getMyCalories(true);
+    });
+
     $("button#logout-button").click(function() {
         clearmessage()
         $.ajax({
@@ -0,0 +1,115 @@
+"""
+Calories statistics from the daily totals
+
+The daily totals of a user are read in date order and folded in one pass:
+rolling averages over the last 7 and 30 calendar days, weekly (ISO weeks,
+starting on Monday) and monthly totals, the days over the daily target and
+percentiles of the daily calories. The days are read into compact arrays of
+integers (a few bytes per day), and the rolling averages are computed over running
+sums of those, so years of history need little memory and time.
+
+The averages are per logged day: days without any record are left out instead
+of counting as zero calories. Rolling windows need window functions with date
+ranges as frames, which are not portable across the supported databases, so they
+are computed here.
+"""
+from array import array
+from bisect import bisect_left
+from datetime import date
+from itertools import accumulate
+
+ROLLING_DAYS = 30  # Longest rolling window
+PERCENTILES = (10, 50, 90)
+SERIES = ('rolling', 'weekly', 'monthly')
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-percent * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def rolling_averages(ordinals, prefix, first, days):
+    """
+    Average calories per logged day over the last ``days`` calendar days (rounded to whole
+    calories), for each day from index ``first``. ``prefix`` holds the running sums of the daily calories, from 0.
+    """
+    averages = []
+    start = 0
+    for end in range(first, len(ordinals)):
+        while ordinals[start] <= ordinals[end] - days:
+            start += 1
+        averages.append(int((prefix[end + 1] - prefix[start]) / (end + 1 - start) + 0.5))
+    return averages
+
+
+def calories_statistics(totals, target, date_start=None, series=SERIES):
+    """
+    Statistics of ``(record_date, calories)`` daily totals in ascending date order, given
+    as an iterable of row batches (e.g. of ``fetchmany()``).
+
+    ``totals`` may start before ``date_start`` to fill the rolling windows, only the
+    days from ``date_start`` are counted otherwise. ``target`` of 0 means no target.
+    """
+    """ Compact arrays of the days: date ordinal, calories and month (year * 12 + month) """
+    ordinals, calories, months = array('l'), array('l'), array('l')
+    for batch in totals:
+        for record_date, day_calories in batch:
+            ordinals.append(record_date.toordinal())
+            calories.append(int(day_calories or 0))
+            months.append(record_date.year * 12 + record_date.month)
+    first = bisect_left(ordinals, date_start.toordinal()) if date_start is not None else 0
+    days = len(ordinals) - first
+
+    counted = calories[first:]
+    total = sum(counted)
+    days_over_target = sum(1 for day_calories in counted if day_calories > target) if target else None
+    sorted_calories = sorted(counted)
+    statistics = {'days': days,
+                  'calories': total,
+                  'average': round(total / days, 1) if days else None,
+                  'percentiles': {'p{}'.format(percent): percentile(sorted_calories, percent)
+                                  for percent in PERCENTILES},
+                  'target_daily_calories': target,
+                  'days_over_target': days_over_target,
+                  'share_over_target': round(days_over_target / days, 4) if target and days else None}
+
+    if 'rolling' in series:
+        prefix = array('q', [0])
+        prefix.extend(accumulate(calories))
+        averages_7d = rolling_averages(ordinals, prefix, first, 7)
+        averages_30d = rolling_averages(ordinals, prefix, first, 30)
+        statistics['rolling'] = [{'record_date': date.fromordinal(ordinal).isoformat(),
+                                  'calories': day_calories,
+                                  'average_7d': average_7d,
+                                  'average_30d': average_30d}
+                                 for ordinal, day_calories, average_7d, average_30d
+                                 in zip(ordinals[first:], counted, averages_7d, averages_30d)]
+    if 'weekly' in series:
+        weekly = []
+        week = None
+        for index in range(first, len(ordinals)):
+            # Ordinal 1 (0001-01-01) is a Monday
+            week_start = ordinals[index] - (ordinals[index] - 1) % 7
+            if week_start != week:
+                week = week_start
+                weekly.append({'week_start': date.fromordinal(week).isoformat(), 'calories': 0, 'days': 0})
+            weekly[-1]['calories'] += calories[index]
+            weekly[-1]['days'] += 1
+        statistics['weekly'] = weekly
+    if 'monthly' in series:
+        monthly = []
+        month = None
+        for index in range(first, len(ordinals)):
+            if months[index] != month:
+                month = months[index]
+                year, month_of_year = divmod(month - 1, 12)
+                monthly.append({'month': '{:04d}-{:02d}'.format(year, month_of_year + 1), 'calories': 0, 'days': 0})
+            monthly[-1]['calories'] += calories[index]
+            monthly[-1]['days'] += 1
+        statistics['monthly'] = monthly
+    return statistics
@@ -0,0 +1,26 @@
+"""
+Input validators
+"""
+from flask_inputs.validators import JsonSchema
+from jsonschema.validators import validator_for
+from wtforms.validators import ValidationError
+
+
+class CompiledJsonSchema(JsonSchema):
+    """
+    Drop-in replacement of ``flask_inputs.validators.JsonSchema`` that checks the schema
+    and builds the validator only once, instead of on every validated request.
+    """
+
+    def __init__(self, schema, message=None):
+        super(CompiledJsonSchema, self).__init__(schema, message)
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+        self.validator = validator_class(schema)
+
+    def iter_errors(self, instance):
+        return self.validator.iter_errors(instance)
+
+    def __call__(self, form, field):
+        for error in self.validator.iter_errors(field.data):
+            raise ValidationError(self.message or error.message)
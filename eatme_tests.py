@@ -1,32 +1,231 @@
-import os
+import json
+import time
 import eatme
 import unittest
-import tempfile
-from base64 import b64encode
+from werkzeug.http import http_date
+
 
 class EatmeTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.db_fd, eatme.app.config['DATABASE'] = tempfile.mkstemp()
-        eatme.app.config['TESTING'] = True
-        self.app = eatme.app.test_client()
-        eatme.init_db()
+        self.app = eatme.create_app({'TESTING': True,
+                                     'DATABASE_URI': 'sqlite://',
+                                     'PASSWORD_HASH_ROUNDS': 4,
+                                     'PASSWORD_HASH_WORKERS': 0})
+        self.client = self.app.test_client(use_cookies=False)
 
     def tearDown(self):
-        os.close(self.db_fd)
-        os.unlink(eatme.app.config['DATABASE'])
+        with self.app.app_context():
+            eatme.db.session.remove()
+            eatme.db.drop_all()
+
+    def post_json(self, path, payload, **kwargs):
+        return self.client.post(path, data=json.dumps(payload), content_type='application/json', **kwargs)
+
+    def get_json(self, path, **kwargs):
+        rv = self.client.get(path, **kwargs)
+        return rv.status_code, json.loads(rv.data.decode('utf-8'))
+
+    def login(self, email="user@example.com", password="allaccess"):
+        """ Register a user and return the user id and the token headers """
+        self.post_json('/api/v1/users', {'email': email, 'password': password})
+        rv = self.post_json('/login', {'email': email, 'password': password})
+        user = json.loads(rv.data.decode('utf-8'))['response']['user']
+        return int(user['id']), {'Authorization': user['authentication_token']}
+
+    def add_record(self, user_id, headers, record_date, calories):
+        """ Add a record through the API and return its id """
+        rv = self.post_json('/api/v1/records', {'record_date': record_date, 'record_time': '12:00',
+                                                'description': 'Meal', 'calories': calories,
+                                                'userid': user_id}, headers=headers)
+        return json.loads(rv.data.decode('utf-8'))['response']['new_record']['id']
+
+    def daily_totals(self, user_id, headers):
+        """ (record_date, calories, record_count) of the user's days, newest first """
+        _, data = self.get_json('/api/v1/users/{}/daily'.format(user_id), headers=headers)
+        return [(day['record_date'], day['calories'], day['record_count']) for day in data['response']['daily']]
 
     def test_nologin(self):
-        rv = self.app.get('/api/v1/users')
-        assert b'Unauthorized Access' in rv.data
+        rv = self.client.get('/api/v1/users')
+        assert rv.status_code == 401
 
     def test_login(self):
-        username, password = "admin", "allaccess"
-        headers = {
-            'Authorization': 'Basic ' + b64encode("{0}:{1}".format(username, password).encode('ascii')).decode('ascii')
-        }
-        rv = self.app.get('/api/v1/users', headers=headers)
-        assert username.encode('ascii') in rv.data
+        email, password = "user@example.com", "allaccess"
+        rv = self.post_json('/api/v1/users', {'email': email, 'password': password})
+        assert rv.status_code == 200
+        rv = self.post_json('/login', {'email': email, 'password': password})
+        token = json.loads(rv.data.decode('utf-8'))['response']['user']['authentication_token']
+        rv = self.client.get('/api/v1/users/self', headers={'Authorization': token})
+        assert email.encode('ascii') in rv.data
+
+    def test_daily_totals(self):
+        user_id, headers = self.login()
+        record_ids = [self.add_record(user_id, headers, record_date, calories)
+                      for record_date, calories in (('2016-04-11', 100), ('2016-04-11', 200), ('2016-04-12', 400))]
+
+        def daily():
+            return self.daily_totals(user_id, headers)
+
+        assert daily() == [('2016-04-12', 400, 1), ('2016-04-11', 300, 2)]
+        rv = self.client.put('/api/v1/records/{}'.format(record_ids[1]), headers=headers,
+                             data=json.dumps({'record_date': '2016-04-13', 'calories': 250}),
+                             content_type='application/json')
+        assert rv.status_code == 200
+        assert daily() == [('2016-04-13', 250, 1), ('2016-04-12', 400, 1), ('2016-04-11', 100, 1)]
+        rv = self.client.delete('/api/v1/records/{}'.format(record_ids[0]), headers=headers)
+        assert rv.status_code == 200
+        assert daily() == [('2016-04-13', 250, 1), ('2016-04-12', 400, 1)]
+
+    def test_daily_totals_bulk_delete(self):
+        user_id, headers = self.login()
+        record_ids = [self.add_record(user_id, headers, record_date, calories)
+                      for record_date, calories in (('2016-04-11', 100), ('2016-04-11', 200),
+                                                    ('2016-04-12', 400), ('2016-04-14', 800))]
+        """ Unknown IDs first, so that the deleted records fall in different IN lists """
+        ids = list(range(100000, 100600)) + [record_ids[0]] + list(range(200000, 200600)) + [record_ids[2]]
+        rv = self.client.delete('/api/v1/users/{}/records'.format(user_id), headers=headers,
+                                data=json.dumps({'ids': ids}), content_type='application/json')
+        assert json.loads(rv.data.decode('utf-8'))['response']['deleted'] == 2
+        assert self.daily_totals(user_id, headers) == [('2016-04-14', 800, 1), ('2016-04-11', 200, 1)]
+
+    def test_daily_totals_patch(self):
+        user_id, headers = self.login()
+        record_ids = [self.add_record(user_id, headers, record_date, calories)
+                      for record_date, calories in (('2016-04-11', 100), ('2016-04-11', 200), ('2016-04-12', 400))]
+        rv = self.client.patch('/api/v1/records/{}'.format(record_ids[0]), headers=headers,
+                               data=json.dumps({'record_date': '2016-04-12'}), content_type='application/json')
+        assert rv.status_code == 200
+        assert self.daily_totals(user_id, headers) == [('2016-04-12', 500, 2), ('2016-04-11', 200, 1)]
+        patches = [{'id': record_ids[1], 'record_date': '2016-04-13', 'calories': 250},
+                   {'id': record_ids[2], 'calories': 50},
+                   {'id': 100000, 'calories': 10}]
+        rv = self.client.patch('/api/v1/records', headers=headers,
+                               data=json.dumps(patches), content_type='application/json')
+        assert json.loads(rv.data.decode('utf-8'))['response']['updated'] == 2
+        assert self.daily_totals(user_id, headers) == [('2016-04-13', 250, 1), ('2016-04-12', 150, 2)]
+
+    def test_records_default_page(self):
+        self.app.config['RECORDS_PAGE_SIZE_MAX'] = 2
+        user_id, headers = self.login()
+        for day in (11, 12, 13):
+            self.add_record(user_id, headers, '2016-04-{}'.format(day), 100)
+        _, data = self.get_json('/api/v1/users/{}/records'.format(user_id), headers=headers)
+        page = data['response']
+        assert [record['record_date'] for record in page['records']] == ['2016-04-13', '2016-04-12']
+        _, data = self.get_json(page['_links']['next'], headers=headers)
+        assert [record['record_date'] for record in data['response']['records']] == ['2016-04-11']
+        assert data['response']['_links'] == {}
+
+    def test_batch_reports_every_item(self):
+        user_id, headers = self.login()
+        record = {'record_date': '2016-04-11', 'record_time': '12:00', 'calories': 100, 'userid': user_id}
+        rv = self.post_json('/api/v1/records/batch', [None, record, 5], headers=headers)
+        response = json.loads(rv.data.decode('utf-8'))['response']
+        assert response['inserted'] == 1
+        assert [error['index'] for error in response['errors']] == [0, 2]
+        rv = self.client.post('/api/v1/records/batch', headers=headers, content_type='application/x-ndjson',
+                              data='null\n{bad\n' + json.dumps(record))
+        response = json.loads(rv.data.decode('utf-8'))['response']
+        assert response['inserted'] == 1
+        assert [(error['index'], error['message']) for error in response['errors']] == \
+            [(0, "A record must be a JSON object."), (1, "Invalid JSON")]
+
+    def admin_headers(self):
+        """ Token headers of the admin account, with a known password """
+        with self.app.app_context():
+            admin = eatme.user_datastore.get_user(self.app.config['ADMIN_EMAIL'])
+            admin.password = eatme.password_hasher.encrypt('adminpass')
+            eatme.db.session.commit()
+        rv = self.post_json('/login', {'email': self.app.config['ADMIN_EMAIL'], 'password': 'adminpass'})
+        return {'Authorization': json.loads(rv.data.decode('utf-8'))['response']['user']['authentication_token']}
+
+    def test_users_listing_etag_same_second(self):
+        user_id, headers = self.login()
+        admin_headers = self.admin_headers()
+        rv = self.client.get('/api/v1/users', headers=admin_headers)
+        etag = rv.headers['ETag']
+        self.client.put('/api/v1/users/{}/targets'.format(user_id), headers=headers,
+                        data=json.dumps({'target_daily_calories': 2000}), content_type='application/json')
+        rv = self.client.get('/api/v1/users', headers=dict(admin_headers, **{'If-None-Match': etag}))
+        assert rv.status_code == 200
+        assert b'2000' in rv.data
+
+    def test_targets_modified_same_second(self):
+        user_id, headers = self.login()
+        path = '/api/v1/users/{}/targets'.format(user_id)
+        rv = self.client.get(path, headers=headers)
+        assert 'Last-Modified' not in rv.headers
+        since = http_date(time.time())
+        self.client.put(path, headers=headers,
+                        data=json.dumps({'target_daily_calories': 2100}), content_type='application/json')
+        rv = self.client.get(path, headers=dict(headers, **{'If-Modified-Since': since}))
+        assert rv.status_code == 200
+        assert b'2100' in rv.data
+
+    def change_user_data(self, statement):
+        """ Write with a core statement, bypassing the ORM events, like another worker process would """
+        with self.app.app_context():
+            eatme.db.session.execute(statement)
+            eatme.db.session.commit()
+
+    def test_token_cache_password_change(self):
+        user_id, headers = self.login()
+        assert self.client.get('/api/v1/users/self', headers=headers).status_code == 200
+        users = eatme.models.User.__table__
+        self.change_user_data(users.update().where(users.c.id == user_id).values(password='changed'))
+        assert self.client.get('/api/v1/users/self', headers=headers).status_code == 401
+
+    def test_token_cache_role_change(self):
+        user_id, headers = self.login()
+        assert self.client.get('/api/v1/users/1/records', headers=headers).status_code == 403
+        with self.app.app_context():
+            editor_id = eatme.user_datastore.find_role('editor').id
+        self.change_user_data(eatme.models.roles_users.insert().values(user_id=user_id, role_id=editor_id))
+        assert self.client.get('/api/v1/users/1/records', headers=headers).status_code == 200
+        self.change_user_data(eatme.models.roles_users.delete())
+        assert self.client.get('/api/v1/users/1/records', headers=headers).status_code == 403
+
+    def test_conditional_get_compressed(self):
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        user_id, headers = self.login()
+        headers['Accept-Encoding'] = 'gzip'
+        path = '/api/v1/users/{}/records'.format(user_id)
+        rv = self.client.get(path, headers=headers)
+        assert rv.status_code == 200 and rv.headers['Content-Encoding'] == 'gzip'
+        etag = rv.headers['ETag']
+        assert etag.startswith('W/')
+        rv = self.client.get(path, headers=dict(headers, **{'If-None-Match': etag}))
+        assert rv.status_code == 304
+        assert rv.headers['ETag'] == etag
+
+    def test_cached_links_without_token(self):
+        user_id, headers = self.login()
+        self.add_record(user_id, headers, '2016-04-10', 100)
+        self.add_record(user_id, headers, '2016-04-11', 200)
+        admin_token = self.admin_headers()['Authorization']
+        path = '/api/v1/users/{}/records?limit=1&auth_token='.format(user_id)
+        for token in (admin_token, headers['Authorization']):
+            status, data = self.get_json(path + token)
+            assert status == 200
+            assert admin_token not in data['response']['_links']['next']
+            assert headers['Authorization'] not in data['response']['_links']['next']
+
+    def test_result_cache_fresh_after_write(self):
+        user_id, headers = self.login()
+        path = '/api/v1/users/{}/daily'.format(user_id)
+        assert self.get_json(path, headers=headers)[1]['response']['daily'] == []
+        self.post_json('/api/v1/records', {'record_date': '2016-04-11', 'record_time': '12:00',
+                                           'description': 'Meal', 'calories': 100, 'userid': user_id},
+                       headers=headers)
+        assert len(self.get_json(path, headers=headers)[1]['response']['daily']) == 1
+
+        """ A write by another worker process is seen once the local entries expire """
+        eatme.result_cache.backend.ttl = 0.1
+        path += '?date_start=2016-04-01'
+        assert len(self.get_json(path, headers=headers)[1]['response']['daily']) == 1
+        self.change_user_data(eatme.models.DailyTotal.__table__.delete())
+        time.sleep(0.2)
+        assert self.get_json(path, headers=headers)[1]['response']['daily'] == []
 
 
 if __name__ == '__main__':
@@ -1,20 +1,24 @@
 """
 Management tools for EatMe
 """
+import time
+
+from flask import current_app
 from flask.ext.script import Server, Shell, Manager, prompt_pass
 from flask.ext.security.utils import encrypt_password
 
 # Import relevant parts of the app
-from eatme import app, db, models
+from eatme import create_app, create_db as _create_db, db, models, password_hasher
+from eatme.seed import seed as seed_database
 
-manager = Manager(app)
+manager = Manager(create_app)
 
 # Run development server
 manager.add_command("runserver", Server())
 
 # Add shell
 def _make_context():
-    return dict(app=app, db=db, models=models)
+    return dict(app=current_app._get_current_object(), db=db, models=models)
 
 manager.add_command("shell", Shell(make_context=_make_context))
 
@@ -23,10 +27,77 @@ def genpwhash():
     """
     Generate password hash for input
     """
-    print("Current password hash algorithm: {}".format(app.config['SECURITY_PASSWORD_HASH']))
+    print("Current password hash algorithm: {}".format(current_app.config['SECURITY_PASSWORD_HASH']))
     password = prompt_pass("Enter password to hash (hidden)")
     print(encrypt_password(password))
 
 
+@manager.command
+def create_db():
+    """
+    Create the database tables and the admin account
+    """
+    _create_db()
+    print("Database created")
+
+
+@manager.command
+def rebuild_daily_totals():
+    """
+    Recreate the daily calories totals from all the records
+    """
+    db.create_all()
+    models.DailyTotal.rebuild()
+    db.session.commit()
+    print("Daily totals rebuilt: {}".format(models.DailyTotal.query.count()))
+
+
+@manager.option('-u', '--users', type=int, default=1000, help="Users to create")
+@manager.option('-r', '--records', type=int, default=1000, help="Records per user, on average")
+@manager.option('-y', '--years', type=float, default=3, help="Longest history, in years")
+@manager.option('--editors', type=float, default=0.05, help="Share of users with the editor role")
+@manager.option('--admins', type=float, default=0.01, help="Share of users with the admin role")
+@manager.option('--password', default='password', help="Password of all the users, hashed once")
+@manager.option('--email-prefix', default='seed', help="Emails are <prefix><n>@example.com")
+@manager.option('--chunk-size', type=int, default=10000, help="Rows per INSERT statement")
+@manager.option('--random-seed', type=int, default=None, help="Seed for reproducible data")
+def seed(users, records, years, editors, admins, password, email_prefix, chunk_size, random_seed):
+    """
+    Generate users, roles and records for scale testing
+    """
+    db.create_all()
+    started = time.time()
+
+    def progress(inserted):
+        print("{} records, {:.0f} records/s".format(inserted, inserted / (time.time() - started)))
+
+    user_ids = seed_database(users, records, password_hasher.encrypt(password), years=years,
+                             editor_share=editors, admin_share=admins, email_prefix=email_prefix,
+                             chunk_size=chunk_size, random_seed=random_seed, progress=progress)
+    print("Seeded {} users in {:.1f} s".format(len(user_ids), time.time() - started))
+
+
+@manager.command
+def upgrade_db():
+    """
+    Bring an existing database up to date: create missing tables and indexes
+    """
+    existing_tables = set(db.engine.table_names())
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                print("Creating index {}".format(index.name))
+                index.create(bind=db.engine)
+    if models.DailyTotal.__tablename__ not in existing_tables:
+        models.DailyTotal.rebuild()
+        db.session.commit()
+        print("Daily totals built: {}".format(models.DailyTotal.query.count()))
+
+
 if __name__ == "__main__":
     manager.run()
@@ -1,2 +1,3 @@
-from eatme import app
+from eatme import create_app
+app = create_app()
 app.run(debug=True)